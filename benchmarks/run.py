@@ -0,0 +1,198 @@
+"""Benchmark dispatch, fetch and render hot paths.
+
+Launch from the root of the repository::
+
+  python -m benchmarks.run --output results.json
+
+Results are written as JSON, with the best and mean durations in seconds of
+one call for each benchmark. Compare two result files with::
+
+  python -m benchmarks.run --compare old.json new.json
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from importlib.metadata import version
+from timeit import Timer
+
+from flask import Flask
+
+from flask_weasyprint import (
+    HTML,
+    make_flask_url_dispatcher,
+    make_url_fetcher,
+    render_pdf,
+)
+from tests import app as demo_app
+
+BENCHMARKS = {}
+IMAGES = 200
+URLS = [
+    *(f'http://localhost/static/{i}.css' for i in range(500)),
+    *(f'https://example.com/{i}.png' for i in range(250)),
+    *(f'http://localhost:8000/{i}.png' for i in range(250))]
+
+
+def benchmark(function):
+    """Register a benchmark, a function returning the callable to time."""
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def _image_app():
+    """Return an app serving a document with many images."""
+    app = Flask(__name__)
+
+    @app.route('/image/<int:number>.svg')
+    def image(number):
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">'
+            f'<rect width="10" height="10" fill="#{number % 0xfff:03x}"/></svg>')
+        return svg, 200, {'Content-Type': 'image/svg+xml'}
+
+    return app
+
+
+@benchmark
+def dispatch():
+    """Dispatch 1000 internal and external URLs, without memoized results."""
+    with demo_app.test_request_context(base_url='http://localhost/'):
+        dispatcher = make_flask_url_dispatcher()
+
+    def run():
+        dispatcher.clear()
+        return [dispatcher(url) for url in URLS]
+
+    return run
+
+
+@benchmark
+def dispatch_memoized():
+    """Dispatch 1000 internal and external URLs already dispatched."""
+    with demo_app.test_request_context(base_url='http://localhost/'):
+        dispatcher = make_flask_url_dispatcher()
+    return lambda: [dispatcher(url) for url in URLS]
+
+
+@benchmark
+def fetch():
+    """Fetch a static file served by a view."""
+    with demo_app.test_request_context(base_url='http://localhost/'):
+        fetcher = make_url_fetcher(cache_size=0)
+    return lambda: fetcher.fetch('http://localhost/static/style.css').read()
+
+
+@benchmark
+def fetch_cookies():
+    """Fetch a static file served by a view, with 20 request cookies."""
+    cookies = '; '.join(f'cookie{i}=value{i}' for i in range(20))
+    with demo_app.test_request_context(
+            base_url='http://localhost/', headers={'Cookie': cookies}):
+        fetcher = make_url_fetcher(cache_size=0)
+    return lambda: fetcher.fetch('http://localhost/static/style.css').read()
+
+
+@benchmark
+def url_fetcher():
+    """Create a URL fetcher."""
+    context = demo_app.test_request_context(base_url='http://localhost/')
+
+    def create():
+        with context:
+            make_url_fetcher()
+
+    return create
+
+
+@benchmark
+def render_demo():
+    """Render the demo document to PDF."""
+    client = demo_app.test_client()
+    return lambda: client.get('/foo.pdf').get_data()
+
+
+@benchmark
+def render_images():
+    """Render a document with many small images to PDF."""
+    app = _image_app()
+    string = ''.join(f'<img src="image/{i}.svg">' for i in range(IMAGES))
+
+    def render():
+        with app.test_request_context(base_url='http://localhost/'):
+            render_pdf(HTML(string=string)).close()
+
+    return render
+
+
+def run(names, repeat):
+    """Run the given benchmarks and return their results."""
+    results = {}
+    for name in names:
+        timer = Timer(BENCHMARKS[name]())
+        number, _ = timer.autorange()
+        durations = [duration / number for duration in timer.repeat(repeat, number)]
+        results[name] = {
+            'description': BENCHMARKS[name].__doc__,
+            'number': number,
+            'best': min(durations),
+            'mean': sum(durations) / len(durations),
+        }
+        sys.stderr.write(f'{name}: {min(durations) * 1000:.3f} ms\n')
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'flask': version('flask'),
+        'weasyprint': version('weasyprint'),
+        'benchmarks': results,
+    }
+
+
+def compare(old, new, threshold):
+    """Write the relative changes between two results, return regressions."""
+    regressions = []
+    for name, result in new['benchmarks'].items():
+        if name not in old['benchmarks']:
+            continue
+        ratio = result['best'] / old['benchmarks'][name]['best']
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        sys.stdout.write(
+            f'{name}: {(ratio - 1) * 100:+.1f}%{" (regression)" * regressed}\n')
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        'benchmarks', nargs='*', metavar='benchmark',
+        help=f'benchmarks to run, among {", ".join(BENCHMARKS)}')
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='number of timed runs')
+    parser.add_argument(
+        '--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='JSON file where results are written')
+    parser.add_argument(
+        '--compare', nargs=2, type=argparse.FileType(), metavar=('OLD', 'NEW'),
+        help='compare two JSON result files instead of running benchmarks')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='relative slowdown considered as a regression when comparing')
+    args = parser.parse_args(arguments)
+    if args.compare:
+        old, new = (json.load(fd) for fd in args.compare)
+        return 1 if compare(old, new, args.threshold) else 0
+    if unknown := set(args.benchmarks) - set(BENCHMARKS):
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+    results = run(args.benchmarks or list(BENCHMARKS), args.repeat)
+    json.dump(results, args.output, indent=2)
+    args.output.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,98 @@
 """Make PDF in your Flask app with WeasyPrint."""
 
+import asyncio
+import functools
+import mimetypes
+import mmap
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from hashlib import sha256
 from io import BytesIO
-from urllib.parse import urljoin, urlsplit
+from itertools import chain
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from time import perf_counter
+from urllib.parse import unquote, unquote_to_bytes, urljoin
 from urllib.request import BaseHandler
 
-from flask import current_app, has_request_context, request, send_file
-from werkzeug.test import Client, EnvironBuilder
-from werkzeug.wrappers import Response
+from flask import Blueprint, Flask, current_app, has_request_context, request, send_file
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.security import safe_join
+from werkzeug.test import EnvironBuilder
+from werkzeug.utils import get_content_type
+
+from .cache import (
+    AssetCache,
+    DocumentCache,
+    FileSystemPdfCache,
+    MemoryPdfCache,
+    StylesheetCache,
+    fragment_cache,
+    get_asset_cache,
+    stylesheet_cache,
+)
+from .context import RenderContext
+from .dispatcher import DEFAULT_PORTS, FlaskURLDispatcher, get_url_dispatcher
+from .extension import FlaskWeasyPrint, get_extension
+from .forwarding import ForwardingPolicy, public_view
+from .fragments import StaticFragment, _Stitcher
+from .images import ImageDownscaler
+from .limiter import RenderLimiter, RenderLimitError, estimate_cost
+from .profiler import AllocationSite, RenderProfile, RenderProfiler
+from .renderer import (
+    BatchRenderer,
+    PdfRenderer,
+    RendererBusyError,
+    get_pdf_renderer,
+    render_many,
+)
+from .rendering import (
+    _STYLESHEET_FINGERPRINTS,
+    READ_CHUNK_SIZE,
+    _arguments,
+    _dependencies_match,
+    _fingerprint,
+    _layout,
+)
+from .stats import (
+    FetchRecord,
+    RenderStats,
+    current_stats,
+    pdf_profiled,
+    pdf_rendered,
+    resource_fetched,
+)
 
 VERSION = __version__ = '1.2.0'
-DEFAULT_PORTS = (('http', 80), ('https', 443))
+__all__ = [
+    'CSS', 'DEFAULT_PORTS', 'HTML', 'AllocationSite', 'AssetCache', 'BatchRenderer',
+    'DocumentCache', 'FetchRecord', 'FileSystemPdfCache', 'FlaskURLDispatcher',
+    'FlaskWeasyPrint', 'ForwardingPolicy', 'ImageDownscaler', 'MemoryPdfCache',
+    'PdfRenderer', 'RenderContext', 'RenderLimitError', 'RenderLimiter',
+    'RenderProfile', 'RenderProfiler', 'RenderStats', 'RendererBusyError',
+    'ResourceTooLargeError', 'StaticFragment', 'StylesheetCache', 'estimate_cost',
+    'fragment_cache', 'get_asset_cache', 'get_extension', 'get_pdf_renderer',
+    'get_url_dispatcher', 'make_flask_url_dispatcher', 'make_url_fetcher',
+    'pdf_profiled', 'pdf_rendered', 'preload', 'public_view', 'render_many',
+    'render_pdf', 'render_pdf_async', 'render_preview', 'resource_fetched',
+    'stylesheet_cache']
+DEFAULT_CACHE_SIZE = 256
+MMAP_THRESHOLD = 1024 * 1024
+DEFAULT_PREFETCH_WORKERS = 8
+SPOOL_MAX_SIZE = 1024 * 1024
+PRELOAD_HTML = '<p style="font-weight: bold">Flask-WeasyPrint</p>'
+SUBRESOURCE_ATTRIBUTES = {
+    'link': 'href', 'img': 'src', 'embed': 'src', 'object': 'data'}
 
+# Arguments of weasyprint.CSS modified by parsing, preventing cache.
+STATEFUL_CSS_ARGUMENTS = frozenset((
+    'font_config', 'counter_style', 'color_profiles', 'matcher', 'page_rules',
+    'layers'))
 
-def make_flask_url_dispatcher():
+def make_flask_url_dispatcher(match_routes=False, context=None):
     """Return a URL dispatcher based on the current request context.
 
     You generally don’t need to call this directly.
@@ -26,54 +106,166 @@ def make_flask_url_dispatcher():
     ``subdomain_matching`` is set, also accept URLs that have that domain name
     or a subdomain thereof.
 
+    The returned :class:`FlaskURLDispatcher` is stored in the app and shared
+    by the requests with the same root URL. If ``match_routes`` is
+    :obj:`True`, URLs matching no route of the app are not dispatched.
+
+    A :class:`RenderContext` can be given as ``context`` instead of using the
+    current request, an :doc:`application context <flask:appcontext>` is then
+    enough.
+
     """
-    def parse_netloc(netloc):
-        """Return (hostname, port)."""
-        parsed = urlsplit(f'http://{netloc}')
-        return parsed.hostname, parsed.port
-
-    app = current_app._get_current_object()
-    root_path = request.script_root
-
-    server_name = app.config.get('SERVER_NAME')
-    if server_name and app.subdomain_matching:
-        hostname, port = parse_netloc(server_name)
-
-        def accept(url):
-            """Accept any URL scheme; also accept subdomains."""
-            return url.hostname is not None and (
-                url.hostname == hostname or
-                url.hostname.endswith(f'.{hostname}'))
+    context = context or RenderContext.from_request()
+    return get_url_dispatcher(
+        current_app._get_current_object(), context.scheme, context.host,
+        context.script_root, match_routes)
+
+
+def _find_static_file(app, adapter, path):
+    """Return the file served by the static route matching path, if any."""
+    path = path.partition('?')[0]
+    try:
+        rule, values = adapter.match(unquote(path), method='GET', return_rule=True)
+    except HTTPException:
+        return
+    if rule.endpoint == 'static':
+        scaffold = app
+        if rule.rule != f'{app.static_url_path}/<path:filename>':
+            return
+    elif rule.endpoint.endswith('.static'):
+        scaffold = app.blueprints.get(rule.endpoint[:-len('.static')])
+        if app.view_functions.get(rule.endpoint) != getattr(
+                scaffold, 'send_static_file', None):
+            return
     else:
-        scheme = request.scheme
-        hostname, port = parse_netloc(request.host)
-
-        def accept(url):
-            """Do not accept subdomains."""
-            return (url.scheme, url.hostname) == (scheme, hostname)
-
-    def dispatch(url_string):
-        if isinstance(url_string, bytes):
-            url_string = url_string.decode()
-        url = urlsplit(url_string)
-        url_port = url.port
-        if (url.scheme, url_port) in DEFAULT_PORTS:
-            url_port = None
-        if accept(url) and url_port == port and url.path.startswith(root_path):
-            netloc = url.netloc
-            if url.port and not url_port:
-                netloc = netloc.rsplit(':', 1)[0]  # remove default port
-            base_url = f'{url.scheme}://{netloc}{root_path}'
-            path = url.path[len(root_path):]
-            if url.query:
-                path = f'{path}?{url.query}'
-            # Ignore url.fragment
-            return app, base_url, path
-
-    return dispatch
-
-
-def make_url_fetcher(dispatcher=None, next_fetcher=True):
+        return
+    if type(scaffold).send_static_file not in (
+            Flask.send_static_file, Blueprint.send_static_file):
+        return  # Custom static view, use it
+    if scaffold.has_static_folder and 'filename' in values:
+        filename = safe_join(scaffold.static_folder, values['filename'])
+        if filename is not None and os.path.isfile(filename):
+            return filename
+
+
+def _read_static_file(filename):
+    """Return (body, headers) for filename, like send_from_directory."""
+    mimetype, encoding = mimetypes.guess_type(filename)
+    headers = {
+        'Content-Type': get_content_type(
+            mimetype or 'application/octet-stream', 'utf-8')}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    with open(filename, 'rb') as fd:
+        size = os.fstat(fd.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            body = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            body = fd.read()
+    headers['Content-Length'] = str(size)
+    return body, headers
+
+
+class ResourceTooLargeError(ValueError):
+    """Raised when fetched resources are larger than the allowed size."""
+
+
+def _collect(chunks, max_size=None, spool_size=SPOOL_MAX_SIZE):
+    """Return ``(body, size, digest)`` for an iterable of bytes chunks.
+
+    The body is returned as bytes, or as a temporary file positioned at the
+    beginning when larger than spool_size. :class:`ResourceTooLargeError` is
+    raised when the body is larger than max_size.
+
+    """
+    hasher, size, spool, parts = sha256(), 0, None, []
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise ResourceTooLargeError(
+                    f'Resource larger than {max_size} bytes')
+            hasher.update(chunk)
+            if spool is None and size > spool_size:
+                # Too large to be kept in memory, move to a temporary file.
+                spool = SpooledTemporaryFile(max_size=spool_size)
+                spool.writelines(parts)
+                parts = None
+            if spool is None:
+                parts.append(chunk)
+            else:
+                spool.write(chunk)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        raise
+    if spool is None:
+        # Joining a single chunk returns it without copy.
+        return b''.join(parts), size, hasher.hexdigest()
+    spool.seek(0)
+    return spool, size, hasher.hexdigest()
+
+
+def _size(body):
+    """Return the size of bytes, a memory map or a seekable file."""
+    if not hasattr(body, 'seek') or isinstance(body, mmap.mmap):
+        return len(body)
+    size = body.seek(0, os.SEEK_END)
+    body.seek(0)
+    return size
+
+
+def _wsgi_environ(base_url, cookie=None, headers=()):
+    """Return a template of WSGI environ for GET requests below base_url."""
+    environ = EnvironBuilder(base_url=base_url, headers=headers).get_environ()
+    # Non-standard keys including the path.
+    del environ['REQUEST_URI'], environ['RAW_URI']
+    if cookie:
+        environ['HTTP_COOKIE'] = cookie
+    return environ
+
+
+def _call_app(app, template, path, headers=None, max_size=None,
+              spool_size=SPOOL_MAX_SIZE):
+    """Return (data, headers, status) for a request made to a WSGI app.
+
+    The request environ is a copy of template with the given path and extra
+    headers. The response body is collected from the returned iterable, see
+    :func:`_collect`.
+
+    """
+    path, _, query = path.partition('?')
+    environ = {
+        **template,
+        'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+        'QUERY_STRING': query.encode().decode('latin-1'),
+        'wsgi.input': BytesIO()}
+    for key, value in (headers or {}).items():
+        environ[f'HTTP_{key.upper().replace("-", "_")}'] = value
+
+    response, written = [], []
+
+    def start_response(status, response_headers, exc_info=None):
+        if exc_info:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response[:] = status, response_headers
+        return written.append
+
+    app_iter = app(environ, start_response)
+    try:
+        data, _, _ = _collect(chain(written, app_iter), max_size, spool_size)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    status, response_headers = response
+    return data, Headers(response_headers), int(status.split()[0])
+
+
+def make_url_fetcher(dispatcher=None, next_fetcher=True,
+                     cache_size=DEFAULT_CACHE_SIZE, shared_cache=False,
+                     static_files=True, context=None, max_size=None,
+                     max_total_size=None, spool_size=SPOOL_MAX_SIZE,
+                     processors=(), forwarding=None):
     """Return a URL fetcher that handles the Flask app routes internally.
 
     You generally don’t need to call this directly.
@@ -92,95 +284,686 @@ def make_url_fetcher(dispatcher=None, next_fetcher=True):
 
     Typically ``base_url + path`` is equivalent to the passed URL.
 
+    Responses of the requests made at the WSGI level are kept in memory for
+    the lifetime of the returned fetcher, so that a stylesheet or an image
+    used many times in a document is only requested once. The cache holds at
+    most ``cache_size`` responses, ``0`` disables it.
+
+    If ``shared_cache`` is :obj:`True`, the responses are also stored in the
+    app’s :class:`AssetCache` (see :func:`get_asset_cache`) and reused by
+    other fetchers, according to their HTTP caching headers. ``shared_cache``
+    can also be an :class:`AssetCache` instance.
+
+    If ``static_files`` is :obj:`True`, files served by the static routes of
+    Flask applications and their blueprints are read from the disk, without
+    making a request to the application. Large files are memory-mapped.
+
+    The ``Cookie`` header given to the application is the one of the current
+    request, or the ``cookie`` of ``context``, a :class:`RenderContext`, with
+    the extra ``headers`` of ``context``. Other headers of the current request
+    are not given to the application.
+    ``forwarding`` is a :class:`ForwardingPolicy` selecting the cookies and
+    headers given to each endpoint of Flask applications.
+
+    Responses of the application larger than ``spool_size`` bytes are written
+    to temporary files and are not cached. :class:`ResourceTooLargeError` is
+    raised for responses larger than ``max_size`` bytes, and when the
+    responses read from the disk, requested to the application or fetched by
+    ``next_fetcher``, not found in caches, are larger than ``max_total_size``
+    bytes. The responses of ``next_fetcher`` are checked while they are read.
+    WeasyPrint then ignores the resource and logs the error.
+
+    ``processors`` is a list of callables modifying fetched resources, such as
+    :class:`ImageDownscaler`, applied in order to the responses of the
+    application and of ``next_fetcher``. They are called with the URL, the
+    response body as :obj:`bytes` or as a file object, and the response
+    headers, and return either :obj:`None` to keep the response unchanged or
+    a new ``(body, headers)`` tuple.
+
     """
-    from weasyprint.urls import URLFetcher, URLFetcherResponse  # lazy loading
+    from weasyprint.urls import URLFetcher  # lazy loading
 
     if next_fetcher is True:
         next_fetcher = URLFetcher
 
+    if context is None and has_request_context():
+        context = RenderContext.from_request()
+
     if dispatcher is None:
-        dispatcher = make_flask_url_dispatcher()
-
-    class FlaskHandler(BaseHandler):
-        def default_open(self, req):
-            url = req.full_url
-            if result := dispatcher(url):
-                app, base_url, path = result
-                client = Client(app, response_wrapper=Response)
-                if has_request_context() and request.cookies:
-                    server_name = EnvironBuilder(path, base_url=base_url).server_name
-                    for cookie_key, cookie_value in request.cookies.items():
-                        client.set_cookie(cookie_key, cookie_value, domain=server_name)
-                response = client.get(path, base_url=base_url)
+        dispatcher = make_flask_url_dispatcher(context=context)
+
+    state = _FetcherState(
+        dispatcher, next_fetcher, cache_size, shared_cache, static_files, context,
+        max_size, max_total_size, spool_size, processors, forwarding)
+    return _fetcher_class(next_fetcher or URLFetcher)(state=state)
+
+
+class _FetcherState:
+    """Settings and caches shared by the fetchers of :func:`make_url_fetcher`."""
+    def __init__(self, dispatcher, next_fetcher, cache_size, shared_cache,
+                 static_files, context, max_size, max_total_size, spool_size,
+                 processors, forwarding):
+        self.dispatcher = dispatcher
+        self.next_fetcher = next_fetcher
+        self.cache_size = cache_size
+        self.shared_cache = shared_cache
+        self.static_files = static_files
+        self.max_size = max_size
+        self.max_total_size = max_total_size
+        self.spool_size = spool_size
+        self.processors = processors
+        self.forwarding = forwarding
+        # Forwarded cookies and headers are part of the cache key, responses
+        # may depend on them.
+        self.cookie = context.cookie if context else None
+        self.request_headers = context.headers if context else ()
+        self.forwarded = {}
+        self.cache, self.cache_lock = OrderedDict(), Lock()
+        self.adapters, self.environs = {}, {}
+        self.total_size, self.total_size_lock = 0, Lock()
+
+    def check_size(self, url, size):
+        """Raise ResourceTooLargeError if the size limit is exceeded."""
+        if self.max_size is not None and size > self.max_size:
+            raise ResourceTooLargeError(
+                f'Resource larger than {self.max_size} bytes: {url}')
+
+    def add_total_size(self, url, size):
+        """Raise ResourceTooLargeError if the total size limit is exceeded.
+
+        Only the responses read from the disk, requested to the app or fetched
+        by the next fetcher are counted, not the responses found in caches.
+
+        """
+        if self.max_total_size is not None:
+            with self.total_size_lock:
+                self.total_size += size
+                if self.total_size > self.max_total_size:
+                    raise ResourceTooLargeError(
+                        f'Resources larger than {self.max_total_size} bytes: '
+                        f'{url}')
+
+    def get_environ(self, base_url, cookie=None, request_headers=()):
+        """Return the template of WSGI environ for requests below base_url."""
+        key = (base_url, cookie, request_headers)
+        if key not in self.environs:
+            self.environs[key] = _wsgi_environ(base_url, cookie, request_headers)
+        return self.environs[key]
+
+    def get_adapter(self, app, base_url):
+        """Return the URL adapter of a Flask app, None for other apps."""
+        if not isinstance(app, Flask):
+            return
+        if (app, base_url) not in self.adapters:
+            self.adapters[app, base_url] = app.create_url_adapter(
+                app.request_class(self.get_environ(base_url)))
+        return self.adapters[app, base_url]
+
+    def get_forwarded(self, app, base_url, path):
+        """Return the (cookie, headers) given to the app for path."""
+        if self.forwarding is None:
+            return self.cookie, self.request_headers
+        key = (app, base_url, path)
+        if key not in self.forwarded:
+            self.forwarded[key] = self.forwarding.forward(
+                app, self.get_adapter(app, base_url), path, self.cookie,
+                self.request_headers)
+        return self.forwarded[key]
+
+    def get_static_file(self, app, base_url, path):
+        """Return the static file served at path, if any."""
+        if not self.static_files:
+            return
+        if (adapter := self.get_adapter(app, base_url)) is not None:
+            return _find_static_file(app, adapter, path)
+
+    def get_response(self, app, base_url, path, headers=None):
+        """Return (data, headers, status) for a request made to the app."""
+        environ = self.get_environ(
+            base_url, *self.get_forwarded(app, base_url, path))
+        data, headers, status = _call_app(
+            app, environ, path, headers, self.max_size, self.spool_size)
+        try:
+            self.add_total_size(f'{base_url}{path}', _size(data))
+        except ResourceTooLargeError:
+            if hasattr(data, 'close'):
+                data.close()
+            raise
+        return data, headers, status
+
+    def get_shared_response(self, app, base_url, path):
+        """Return a response from the shared cache, request the app if needed."""
+        if isinstance(self.shared_cache, AssetCache):
+            asset_cache = self.shared_cache
+        elif self.shared_cache:
+            asset_cache = get_asset_cache(app)
+        else:
+            return self.get_response(app, base_url, path)
+        return asset_cache.fetch(
+            (app, base_url, path, *self.get_forwarded(app, base_url, path)),
+            lambda headers: self.get_response(app, base_url, path, headers))
+
+    def get_cached_response(self, app, base_url, path):
+        """Return a cached response, request the app if needed."""
+        if not self.cache_size:
+            return self.get_shared_response(app, base_url, path)
+        key = (app, base_url, path, *self.get_forwarded(app, base_url, path))
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        result = self.get_shared_response(app, base_url, path)
+        if not isinstance(result[0], bytes):
+            return result  # Large responses are not cached
+        with self.cache_lock:
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+
+class _FlaskHandler(BaseHandler):
+    """:mod:`urllib` handler making requests to Flask apps at the WSGI level."""
+    def default_open(self, req):
+        from weasyprint.urls import URLFetcherResponse  # lazy loading
+
+        url, state = req.full_url, self.parent._state
+        if result := self.parent._dispatch(url):
+            if filename := state.get_static_file(*result):
+                data, headers = _read_static_file(filename)
+                status = 200
+            else:
+                data, headers, status = state.get_cached_response(*result)
+            try:
+                state.check_size(url, _size(data))
+                if filename:
+                    state.add_total_size(url, _size(data))
+            except ResourceTooLargeError:
+                if hasattr(data, 'close'):
+                    data.close()
+                raise
+            response = URLFetcherResponse(url, data, headers, status)
+            response.msg = ''
+            return response
+
+
+class _CountingBody:
+    """File object counting the bytes read from a response.
+
+    ``callback`` is called with the number of read bytes when closed.
+
+    """
+    def __init__(self, response, callback):
+        self._response = response
+        self._callback = callback
+        self._size = 0
+
+    def read(self, *args, **kwargs):
+        data = self._response.read(*args, **kwargs)
+        self._size += len(data)
+        return data
+
+    def close(self):
+        self._response.close()
+        if self._callback is not None:
+            callback, self._callback = self._callback, None
+            callback(self._size)
+
+
+class _LimitedBody:
+    """File object checking the size limits of a response while it is read."""
+    def __init__(self, response, url, state):
+        self._response = response
+        self._url = url
+        self._state = state
+        self._size = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(READ_CHUNK_SIZE), b''))
+        data = self._response.read(size)
+        self._size += len(data)
+        try:
+            self._state.check_size(self._url, self._size)
+            self._state.add_total_size(self._url, len(data))
+        except ResourceTooLargeError:
+            self.close()
+            raise
+        return data
+
+    def close(self):
+        self._response.close()
+
+
+class _FlaskFetcher:
+    """URL fetcher dispatching URLs to Flask apps, see :func:`make_url_fetcher`.
+
+    This class is mixed with the class of the next fetcher by
+    :func:`_fetcher_class`.
+
+    """
+    def __init__(self, *args, state, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.add_handler(_FlaskHandler())
+        self._state = state
+        self._prefetched = {}
+        #: If a dict, the SHA-256 digests of fetched resources by URL.
+        self.fetched = None
+        #: If a :class:`RenderStats`, where fetched resources are recorded.
+        self.stats = current_stats.get()
+        self._last_dispatch = (None, None)
+
+    def copy(self):
+        """Return a new fetcher sharing the settings and caches of this one.
+
+        URL fetchers are not thread-safe, threads can use copies instead.
+
+        """
+        return type(self)(state=self._state)
+
+    @property
+    def prefetched(self):
+        """Dict of ``(url, data, headers, status)`` for prefetched URLs."""
+        return {
+            url: (result[0], result[1], dict(result[2].items()), result[3])
+            for url, result in self._prefetched.items() if result}
+
+    def prefetch(self, urls, max_workers=DEFAULT_PREFETCH_WORKERS,
+                 external=True):
+        """Concurrently fetch urls, and keep their responses in memory.
+
+        Stylesheets are parsed, and the resources they reference are
+        prefetched too. Errors are ignored, they are raised again when the
+        URLs are fetched. If ``external`` is :obj:`False`, only the URLs
+        handled by the dispatcher are prefetched.
+
+        """
+        def fetch(url):
+            # URL fetchers are not thread-safe, use one per request.
+            try:
+                fetcher = self.copy()
+                fetcher.stats = self.stats
+                response = fetcher.fetch(url)
+                try:
+                    data = response.read()
+                finally:
+                    response.close()
+            except Exception:
+                return url, None
+            return url, (response.url, data, response.headers, response.status)
+
+        urls = set(urls)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while urls := urls - self._prefetched.keys():
+                if not external:
+                    urls = {url for url in urls if self._dispatch(url)}
+                    if not urls:
+                        break
+                self._prefetched.update(executor.map(fetch, urls))
+                urls = {
+                    url for key in urls
+                    if (result := self._prefetched[key])
+                    if result[2].get_content_type() == 'text/css'
+                    for url in _css_subresources(
+                        result[1].decode(
+                            result[2].get_content_charset() or 'utf-8',
+                            errors='replace'),
+                        result[0])}
+
+    def fetch(self, url, headers=None):
+        from weasyprint.urls import URLFetcherResponse  # lazy loading
+
+        state = self._state
+        # Prefetched responses have been recorded when prefetched.
+        record = (
+            (self.stats is not None or bool(resource_fetched.receivers)) and
+            not self._prefetched.get(url))
+        start = perf_counter()
+        try:
+            response = self._fetch_response(url, headers)
+        except Exception as exception:
+            if record:
+                self._record(url, getattr(exception, 'code', None), 0, start)
+            raise
+        if self.fetched is None and not state.processors:
+            if record:
+                # Count the bytes read by WeasyPrint, without copying the body.
+                status = response.status
+                body = _CountingBody(
+                    response,
+                    lambda size: self._record(url, status, size, start))
                 response = URLFetcherResponse(
-                        url, response.data, response.headers, response.status_code)
-                response.msg = ''
+                    response.url, body, response.headers, status)
+            return response
+        try:
+            data, size, digest = _collect(
+                iter(lambda: response.read(READ_CHUNK_SIZE), b''),
+                spool_size=state.spool_size)
+        finally:
+            response.close()
+        if self.fetched is not None:
+            self.fetched[url] = digest
+        headers = response.headers
+        for processor in state.processors:
+            if (result := processor(url, data, headers)) is not None:
+                data, headers = result
+        response = URLFetcherResponse(
+            response.url, data, headers, response.status)
+        if record:
+            self._record(url, response.status, size, start)
+        return response
+
+    def _record(self, url, status, size, start):
+        record = FetchRecord(
+            url, self._dispatch(url) is not None, status, size,
+            perf_counter() - start)
+        if self.stats is not None:
+            self.stats.fetches.append(record)
+        resource_fetched.send(self, record=record)
+
+    def _dispatch(self, url):
+        # The same URL is dispatched when fetched, opened and recorded.
+        if self._last_dispatch[0] != url:
+            self._last_dispatch = (url, self._state.dispatcher(url))
+        return self._last_dispatch[1]
+
+    def _fetch_response(self, url, headers):
+        from weasyprint.urls import URLFetcher, URLFetcherResponse  # lazy loading
+
+        if result := self._prefetched.get(url):
+            return URLFetcherResponse(*result)
+        if self._dispatch(url) is None:
+            if not self._state.next_fetcher:
+                raise ValueError(f'Unknown Flask app URL: {url}')
+            response = super().fetch(url, headers)
+            state = self._state
+            if state.max_size is None and state.max_total_size is None:
                 return response
+            if length := response.headers.get('Content-Length', '').strip():
+                try:
+                    state.check_size(url, int(length))
+                except ResourceTooLargeError:
+                    response.close()
+                    raise
+                except ValueError:
+                    pass  # Invalid lengths are checked while reading
+            return URLFetcherResponse(
+                response.url, _LimitedBody(response, url, state),
+                response.headers, response.status)
+        return URLFetcher.fetch(self, url, headers)
 
-    class FlaskFetcher(next_fetcher or URLFetcher):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            self.add_handler(FlaskHandler())
 
-        def fetch(self, url, headers=None):
-            if dispatcher(url) is None:
-                if next_fetcher:
-                    return super().fetch(url, headers)
-                else:
-                    raise ValueError(f'Unknown Flask app URL: {url}')
-            return URLFetcher.fetch(self, url, headers)
+@functools.cache
+def _fetcher_class(next_fetcher):
+    """Return the class of URL fetchers with the given next fetcher class."""
+    return type('FlaskFetcher', (_FlaskFetcher, next_fetcher), {})
 
-    return FlaskFetcher()
 
+def _css_urls(tokens):
+    """Yield the URLs referenced by tinycss2 tokens."""
+    for token in tokens:
+        if token.type == 'url':
+            yield token.value
+        elif token.type == 'function':
+            if token.lower_name == 'url':
+                yield from (
+                    argument.value for argument in token.arguments
+                    if argument.type == 'string')
+            yield from _css_urls(token.arguments)
+        elif token.type == 'at-rule':
+            if token.lower_at_keyword == 'import':
+                yield from (
+                    argument.value for argument in token.prelude
+                    if argument.type == 'string')
+            yield from _css_urls(token.prelude)
+            yield from _css_urls(token.content or ())
+        elif token.type == 'qualified-rule':
+            yield from _css_urls(token.prelude)
+            yield from _css_urls(token.content)
+        elif token.type.endswith('block'):
+            yield from _css_urls(token.content)
+
+
+def _absolute_urls(urls, base_url):
+    """Yield the absolute URLs of urls, as given to URL fetchers."""
+    from weasyprint.urls import iri_to_uri  # lazy loading
+
+    for url in urls:
+        url = url.strip()
+        if url and not url.startswith(('#', 'data:')):
+            yield iri_to_uri(urljoin(base_url or '', url))
+
+
+def _css_subresources(css, base_url):
+    """Return the absolute URLs referenced by a CSS string."""
+    import tinycss2  # lazy loading
+
+    return set(_absolute_urls(
+        _css_urls(tinycss2.parse_stylesheet(css)), base_url))
 
-def _wrapper(class_, *args, **kwargs):
-    if args:
-        guess, args = args[0], args[1:]
-    else:
-        guess = kwargs.pop('guess', None)
-    if guess is not None and not hasattr(guess, 'read'):
-        # Assume a (possibly relative) URL
-        guess = urljoin(request.url, guess)
-    if 'string' in kwargs and 'base_url' not in kwargs:
-        # Strings do not have an "intrinsic" base URL, use the request context.
-        kwargs['base_url'] = request.url
-    kwargs['url_fetcher'] = make_url_fetcher()
-    return class_(guess, *args, **kwargs)
+
+def _html_subresources(html):
+    """Return the absolute URLs referenced by a weasyprint.HTML object."""
+    import tinycss2  # lazy loading
+
+    urls = set()
+    for element in html.etree_element.iter():
+        if not isinstance(element.tag, str):
+            continue  # Comments and processing instructions
+        if element.tag == 'style':
+            urls |= _css_subresources(element.text or '', html.base_url)
+        elif element.tag == 'link':
+            if 'stylesheet' not in element.get('rel', '').lower().split():
+                continue
+        if attribute := SUBRESOURCE_ATTRIBUTES.get(element.tag):
+            if value := element.get(attribute):
+                urls |= set(_absolute_urls([value], html.base_url))
+        if style := element.get('style'):
+            urls |= set(_absolute_urls(
+                _css_urls(tinycss2.parse_component_value_list(style)),
+                html.base_url))
+    return urls
+
+
+def _make_url_fetcher(context, shared_cache=False):
+    """Return a URL fetcher configured by the extension of the current app.
+
+    If ``shared_cache`` is :obj:`True`, the fetcher uses a shared cache even
+    if not configured.
+
+    """
+    options = {}
+    if (extension := get_extension()) is not None:
+        options = extension.fetcher_options(current_app, context)
+    if shared_cache and not options.get('shared_cache'):
+        options['shared_cache'] = True
+    return make_url_fetcher(context=context, **options)
 
 
 def HTML(*args, **kwargs):  # noqa: N802
     """Like :class:`weasyprint.HTML` but:
 
-    * :func:`make_url_fetcher` is used to create an ``url_fetcher``
+    * :func:`make_url_fetcher` is used to create an ``url_fetcher``, unless
+      one is given
     * If ``guess`` is not a file object, it is a URL relative to the current
       request context. This means that you can just pass a result from
       :func:`flask.url_for`.
     * If ``string`` is passed, ``base_url`` defaults to the current
       request’s URL.
 
-    This requires a Flask :doc:`request context <flask:reqcontext>`.
+    This requires a Flask :doc:`request context <flask:reqcontext>`, unless a
+    :class:`RenderContext` is given as ``context``.
+
+    If the app has a :class:`FlaskWeasyPrint` extension, the URL fetcher is
+    configured by its configuration values.
+
+    If ``prefetch`` is :obj:`True`, the stylesheets, images and other
+    resources referenced by the document are fetched concurrently when the
+    HTML object is created, instead of one after the other during the layout.
+    ``prefetch`` can also be the number of threads used to fetch resources.
+
+    If ``profiler`` is a :class:`RenderProfiler`, the memory and the time used
+    to create the HTML object are profiled.
 
     """
     from weasyprint import HTML  # lazy loading
-    return _wrapper(HTML, *args, **kwargs)
+    prefetch = kwargs.pop('prefetch', False)
+    profiler = kwargs.pop('profiler', None)
+    context = kwargs.pop('context', None) or RenderContext.from_request()
+    url_fetcher = kwargs.pop('url_fetcher', None) or _make_url_fetcher(context)
+    guess, args, kwargs = _arguments(args, kwargs, context.url)
+    with nullcontext() if profiler is None else profiler.profile() as profile:
+        html = HTML(guess, *args, url_fetcher=url_fetcher, **kwargs)
+        if profile is not None:
+            profile.url = html.base_url
+        if prefetch:
+            max_workers = (
+                DEFAULT_PREFETCH_WORKERS if prefetch is True else prefetch)
+            html.url_fetcher.prefetch(_html_subresources(html), max_workers)
+    return html
 
 
 def CSS(*args, **kwargs):  # noqa: N802
     from weasyprint import CSS  # lazy loading
-    return _wrapper(CSS, *args, **kwargs)
+    cache = kwargs.pop('cache', True)
+    context = kwargs.pop('context', None) or RenderContext.from_request()
+    guess, args, kwargs = _arguments(args, kwargs, context.url)
+    # Dependencies are kept in the asset cache, so that checking them before
+    # reusing a stylesheet makes conditional requests to the app.
+    if (url_fetcher := kwargs.pop('url_fetcher', None)) is None:
+        url_fetcher = _make_url_fetcher(context, shared_cache=cache)
+
+    # Stylesheets from URLs and strings only depend on their arguments and
+    # fetched resources, others can’t be cached or fingerprinted. Fetched
+    # resources are only known by the fetchers of make_url_fetcher.
+    key = None
+    files = any(hasattr(source, 'read') for source in (guess, *args))
+    if not files and not {'filename', 'file_obj'} & kwargs.keys():
+        if hasattr(url_fetcher, 'fetched'):
+            key = repr((guess, args, sorted(kwargs.items())))
+    if cache and STATEFUL_CSS_ARGUMENTS & kwargs.keys():
+        cache = False
+    if key is not None and cache:
+        if entry := stylesheet_cache.get(key):
+            dependencies, css = entry
+            if _dependencies_match(url_fetcher, dependencies):
+                return css
+
+    if key is None:
+        return CSS(guess, *args, url_fetcher=url_fetcher, **kwargs)
+    url_fetcher.fetched = {}
+    css = CSS(guess, *args, url_fetcher=url_fetcher, **kwargs)
+    dependencies, url_fetcher.fetched = url_fetcher.fetched, None
+    fingerprint = repr((key, sorted(dependencies.items())))
+    _STYLESHEET_FINGERPRINTS[css] = sha256(fingerprint.encode()).hexdigest()
+    if cache:
+        stylesheet_cache.set(key, dependencies, css)
+    return css
+
+
+CSS.__doc__ = HTML.__doc__.replace('HTML', 'CSS').split('    If ``prefetch``')[0] + '''\
+    Parsed stylesheets are kept in a process-wide :class:`StylesheetCache`,
+    and reused while the resources fetched to parse them don’t change. These
+    resources are kept in the app’s :class:`AssetCache` (see
+    :func:`get_asset_cache`), and checked with conditional requests when
+    their responses include an ``ETag`` or a ``Last-Modified`` header.
+    Stylesheets created from files, or with arguments such as
+    ``font_config`` that are modified while parsing, are not cached. Set
+    ``cache`` to :obj:`False` to disable the cache.
 
+    '''
 
-CSS.__doc__ = HTML.__doc__.replace('HTML', 'CSS')
+
+def preload(stylesheets=(), render=True, app=None):
+    """Import WeasyPrint and initialize its libraries before rendering.
+
+    The first rendered document otherwise pays for importing WeasyPrint and
+    its dependencies, for initializing Pango and Fontconfig, and for
+    discovering fonts. If ``render`` is :obj:`True`, a tiny document is
+    rendered to PDF to warm up layout, fonts and PDF generation.
+
+    ``stylesheets`` are URLs of stylesheets, relative to the root URL of
+    ``app`` (the current app by default) given by the ``SERVER_NAME``,
+    ``APPLICATION_ROOT`` and ``PREFERRED_URL_SCHEME`` :doc:`configuration
+    <flask:config>` values. They are parsed with :func:`CSS` and stored in
+    its cache, the list of parsed stylesheets is returned. Stylesheets are
+    cached by absolute URL, ``SERVER_NAME`` must be the host of the requests
+    rendering documents for the preloaded stylesheets to be reused.
+
+    When called while creating the app, with Gunicorn’s ``preload_app``
+    setting, the warm state is shared by the forked worker processes.
+
+    """
+    from weasyprint import HTML  # lazy loading
+    from weasyprint.text.fonts import FontConfiguration  # lazy loading
+
+    FontConfiguration()  # Load the Fontconfig configuration and fonts
+    if render:
+        HTML(string=PRELOAD_HTML).write_pdf()
+    if not stylesheets:
+        return []
+    app = app or current_app
+    with app.app_context():
+        context = RenderContext.from_config(app=app)
+        return [CSS(stylesheet, context=context) for stylesheet in stylesheets]
+
+
+def _write_pdf(html, target, stylesheets, options, stats, document=None,
+               pages=None, stitcher=None):
+    """Write html as PDF to target, recording layout and PDF times.
+
+    ``document`` is the laid out html, if already available. The pages of
+    static fragments are added by ``stitcher``. Only the pages whose indexes
+    are in ``pages`` are written, if given, :class:`NotFound` is raised for
+    invalid indexes. Return ``(pdf, document)``.
+
+    """
+    start = perf_counter()
+    if not hasattr(html, 'render'):
+        pdf = html.write_pdf(target, stylesheets=stylesheets, **options)
+        stats.layout_time += perf_counter() - start
+        return pdf, None
+
+    from weasyprint import DEFAULT_OPTIONS  # lazy loading
+
+    # Same as weasyprint.HTML.write_pdf, split in two timed phases.
+    if document is None:
+        document = _layout(html, stylesheets, options)
+        stats.layout_time += perf_counter() - start
+    all_pages = document.pages
+    if stitcher is not None:
+        start = perf_counter()
+        all_pages = stitcher.stitch(all_pages)
+        stats.layout_time += perf_counter() - start
+    if pages is not None:
+        if invalid := [
+                index for index in pages if not 0 <= index < len(all_pages)]:
+            raise NotFound(
+                f'Pages {invalid} not in document of {len(all_pages)} pages')
+        all_pages = [all_pages[index] for index in pages]
+    start = perf_counter()
+    # Documents are written with fonts of their own, cached documents are
+    # never written and can be shared between threads.
+    output = document.copy(all_pages)
+    zoom, finisher = options.get('zoom', 1), options.get('finisher')
+    options = {**DEFAULT_OPTIONS, **options, 'stylesheets': stylesheets}
+    options = {key: options[key] for key in DEFAULT_OPTIONS}
+    pdf = output.write_pdf(target, zoom, finisher, **options)
+    stats.pdf_time = perf_counter() - start
+    return pdf, document
 
 
 def render_pdf(html, stylesheets=None, download_filename=None,
-               automatic_download=True, **options):
+               automatic_download=True, stream=False, pdf_cache=None,
+               server_timing=False, stats=None, context=None,
+               document_cache=None, pages=None, limiter=None, before=(),
+               after=(), profiler=None, **options):
     """Render a PDF to a response with the correct ``Content-Type`` header.
 
     :param html:
         Either a :class:`weasyprint.HTML` object or a URL to be passed
         to :func:`flask_weasyprint.HTML`. The latter case requires
-        a request context.
+        a request context or a ``context``.
     :param list stylesheets:
         A list of user stylesheets, passed to
         :meth:`weasyprint.HTML.write_pdf`.
@@ -192,13 +975,241 @@ def render_pdf(html, stylesheets=None, download_filename=None,
         Named properties given to :class:`weasyprint.HTML.write_pdf`.
     :param bool automatic_download:
         If :obj:`True`, the browser will automatic download file.
+    :param bool stream:
+        If :obj:`True`, the PDF is written to a temporary file, kept in memory
+        up to 1 MiB and moved to the disk when larger, and the response is
+        streamed from this file instead of being kept in memory.
+    :param pdf_cache:
+        A PDF cache such as :class:`MemoryPdfCache` or
+        :class:`FileSystemPdfCache`. PDF files are cached by a fingerprint of
+        the HTML source, the stylesheets and the options, and are reused
+        while the resources used for the layout don’t change. Cached
+        responses have a strong ``ETag``.
+    :param bool server_timing:
+        If :obj:`True`, the durations of the rendering phases are given in
+        the ``Server-Timing`` header of the response.
+    :param stats:
+        A :class:`RenderStats` object filled during the rendering. The
+        :data:`pdf_rendered` signal is sent with these statistics.
+    :param context:
+        A :class:`RenderContext` used instead of the current request to
+        create the HTML object. Responses can then be created without request
+        context, in background jobs for example.
+    :param document_cache:
+        A :class:`DocumentCache`. Laid out documents are cached by the same
+        fingerprint as PDF files, and are reused to render other pages of
+        the document without laying it out again.
+    :param pages:
+        An iterable of the indexes of the pages included in the PDF, all the
+        pages by default. A ``404 Not Found`` error is raised for indexes out
+        of the document.
+    :param limiter:
+        A :class:`RenderLimiter` limiting the number of documents rendered at
+        the same time, and the resources used to render them. Documents found
+        in the caches are not limited.
+    :param before:
+        A list of :class:`StaticFragment` whose pages are inserted before the
+        pages of the document.
+    :param after:
+        A list of :class:`StaticFragment` whose pages are inserted after the
+        pages of the document.
+    :param profiler:
+        A :class:`RenderProfiler` profiling the memory and the time used to
+        render the document.
     :returns: a :class:`flask.Response` object.
 
+    Range requests are supported.
+
+    If the app has a :class:`FlaskWeasyPrint` extension, documents share a
+    font configuration if ``WEASYPRINT_SHARE_FONT_CONFIG`` is set, unless
+    ``font_config`` is given, and its :attr:`FlaskWeasyPrint.document_cache`,
+    :attr:`FlaskWeasyPrint.limiter` and :attr:`FlaskWeasyPrint.profiler` are
+    used by default.
+
+    """
+    stats = RenderStats() if stats is None else stats
+    extension = get_extension()
+    if profiler is None and extension:
+        profiler = extension.profiler
+    with nullcontext() if profiler is None else profiler.profile(stats) as profile:
+        start = perf_counter()
+        token = current_stats.set(stats)
+        try:
+            if not hasattr(html, 'write_pdf'):
+                html = HTML(html, context=context)
+        finally:
+            current_stats.reset(token)
+        stats.html_time = perf_counter() - start
+        if profile is not None:
+            profile.url = getattr(html, 'base_url', None)
+        url_fetcher = getattr(html, 'url_fetcher', None)
+        if hasattr(url_fetcher, 'stats'):
+            url_fetcher.stats = stats
+        font_config = None
+        if extension:
+            if 'font_config' not in options:
+                if current_app.config['WEASYPRINT_SHARE_FONT_CONFIG']:
+                    font_config = extension.font_config
+            if document_cache is None:
+                document_cache = extension.document_cache
+            if limiter is None:
+                limiter = extension.limiter
+        stitcher = None
+        if before or after:
+            context = context or RenderContext.from_request()
+            stitcher = _Stitcher(
+                before, after, options, context.url,
+                functools.partial(CSS, context=context),
+                functools.partial(_make_url_fetcher, context), font_config)
+        try:
+            pdf, etag = _render_cached_pdf(
+                html, stylesheets, stream, pdf_cache, options, stats, font_config,
+                document_cache, pages, limiter, stitcher)
+        finally:
+            if hasattr(url_fetcher, 'stats'):
+                url_fetcher.stats = None
+    if has_request_context():
+        response = _pdf_response(
+            pdf, download_filename, automatic_download, etag)
+    else:
+        # Responses are built with a request only used for conditional requests.
+        with current_app.test_request_context():
+            response = _pdf_response(
+                pdf, download_filename, automatic_download, etag)
+    if server_timing:
+        response.headers['Server-Timing'] = stats.server_timing()
+    pdf_rendered.send(
+        current_app._get_current_object(), stats=stats, response=response)
+    return response
+
+
+def _render_cached_pdf(html, stylesheets, stream, pdf_cache, options, stats,
+                       font_config=None, document_cache=None, pages=None,
+                       limiter=None, stitcher=None):
+    """Return ``(pdf, etag)``, with pdf rendered or found in pdf_cache.
+
+    The shared ``font_config`` doesn’t change the rendering, it is not part of
+    the fingerprint. The laid out document is found in or stored in
+    ``document_cache``. The rendering is limited by ``limiter``. Static
+    fragments are added by ``stitcher``, prepared when the document is
+    rendered.
+
+    """
+    fingerprint = pdf_key = None
+    if pdf_cache is not None or document_cache is not None:
+        fingerprint = pdf_key = _fingerprint(html, stylesheets, options)
+    if pages is not None:
+        pages = tuple(pages)
+    if fingerprint is not None and stitcher is not None:
+        # Fragments number the pages of documents.
+        fingerprint = pdf_key = sha256(
+            f'{fingerprint} {stitcher.key}'.encode()).hexdigest()
+    if fingerprint is not None and pages is not None:
+        pdf_key = sha256(f'{fingerprint} {pages}'.encode()).hexdigest()
+    if font_config is not None:
+        options = {**options, 'font_config': font_config}
+    if pdf_cache is not None and pdf_key is not None:
+        if (entry := pdf_cache.get(pdf_key)) is not None:
+            dependencies, etag, pdf = entry
+            html.url_fetcher.fetched = None
+            if _dependencies_match(html.url_fetcher, dependencies):
+                stats.cached = True
+                return pdf, etag
+            if not isinstance(pdf, bytes):
+                pdf.close()
+    document, dependencies = None, {}
+    if document_cache is not None and fingerprint is not None:
+        if (entry := document_cache.get(fingerprint)) is not None:
+            html.url_fetcher.fetched = None
+            if _dependencies_match(html.url_fetcher, entry[0]):
+                dependencies, document = entry
+    if fingerprint is not None:
+        html.url_fetcher.fetched = {}
+    with nullcontext() if limiter is None else limiter.limit(html):
+        if stitcher is not None:
+            start = perf_counter()
+            stylesheets = stitcher.prepare(stylesheets)
+            stats.layout_time += perf_counter() - start
+        if stream:
+            pdf = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            try:
+                _, layout = _write_pdf(
+                    html, pdf, stylesheets, options, stats, document, pages,
+                    stitcher)
+                stats.pdf_size = pdf.tell()
+                pdf.seek(0)
+            except BaseException:
+                pdf.close()
+                raise
+        else:
+            pdf, layout = _write_pdf(
+                html, None, stylesheets, options, stats, document, pages,
+                stitcher)
+            stats.pdf_size = len(pdf)
+    etag = None
+    if fingerprint is not None:
+        dependencies = {**dependencies, **html.url_fetcher.fetched}
+        html.url_fetcher.fetched = None
+        if stitcher is not None:
+            # Pages are numbered after the pages of the fragments.
+            dependencies.update(stitcher.dependencies)
+        if document_cache is not None and layout is not None and layout is not document:
+            document_cache.set(fingerprint, dependencies, layout)
+        if pdf_cache is not None and pdf_key is not None:
+            etag = pdf_cache.set(pdf_key, dependencies, pdf)
+    return pdf, etag
+
+
+def render_preview(html, stylesheets=None, pages=(0,), **options):
+    """Render a preview of a document, its first page by default.
+
+    This is a shortcut for :func:`render_pdf` with ``pages``. With a
+    ``document_cache``, previews of documents already rendered, and
+    documents whose preview has already been rendered, are laid out once.
+
+    """
+    return render_pdf(html, stylesheets, pages=pages, **options)
+
+
+async def render_pdf_async(html, stylesheets=None, download_filename=None,
+                           automatic_download=True, renderer=None, **options):
+    """Like :func:`render_pdf`, but render the PDF in a worker process.
+
+    The document and its resources served by the app are fetched in the
+    current request context, the layout and the PDF generation are done by
+    ``renderer``, a :class:`PdfRenderer` (by default the one returned by
+    :func:`get_pdf_renderer`). ``html`` is a URL and ``stylesheets`` a list
+    of URLs, relative to the current request.
+
+    This coroutine is meant to be awaited in ``async`` Flask views.
+
+    """
+    if renderer is None:
+        renderer = get_pdf_renderer(current_app)
+    pdf = await asyncio.wrap_future(renderer.submit(html, stylesheets, **options))
+    return _pdf_response(pdf, download_filename, automatic_download)
+
+
+def _pdf_response(pdf, download_filename, automatic_download, etag=None):
+    """Return a PDF response, with the given download options.
+
+    ``pdf`` is either bytes or a file object, positioned at the beginning of
+    the PDF. If ``etag`` is given, conditional requests are handled.
+
     """
-    if not hasattr(html, 'write_pdf'):
-        html = HTML(html)
-    pdf = html.write_pdf(stylesheets=stylesheets, **options)
     as_attachment = automatic_download if download_filename else False
-    return send_file(
-        BytesIO(pdf), mimetype='application/pdf', as_attachment=as_attachment,
-        download_name=download_filename)
+    if isinstance(pdf, bytes):
+        return send_file(
+            BytesIO(pdf), mimetype='application/pdf', as_attachment=as_attachment,
+            download_name=download_filename, etag=etag or False)
+    # The size of files other than BytesIO is unknown to send_file.
+    size = pdf.seek(0, os.SEEK_END)
+    pdf.seek(0)
+    response = send_file(
+        pdf, mimetype='application/pdf', as_attachment=as_attachment,
+        download_name=download_filename, conditional=False)
+    response.content_length = size
+    if etag:
+        response.set_etag(etag)
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=size)
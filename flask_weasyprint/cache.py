@@ -0,0 +1,310 @@
+"""Caches shared between renders."""
+
+import json
+import os
+import shutil
+from collections import OrderedDict
+from hashlib import sha256
+from math import inf
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import monotonic
+
+from werkzeug.datastructures import ResponseCacheControl
+from werkzeug.http import parse_cache_control_header
+
+DEFAULT_ASSET_CACHE_SIZE = 1024
+DEFAULT_PDF_CACHE_SIZE = 64
+DEFAULT_STYLESHEET_CACHE_SIZE = 128
+DEFAULT_DOCUMENT_CACHE_SIZE = 16
+DEFAULT_DOCUMENT_CACHE_TTL = 300
+DEFAULT_FRAGMENT_CACHE_SIZE = 64
+VALIDATORS = (('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since'))
+
+
+class AssetCache:
+    """Bounded LRU cache of app responses, shared between renders.
+
+    Only successful responses kept in memory are stored, and only when they
+    can be reused: responses with ``Cache-Control: no-store`` are ignored,
+    responses are fresh for ``max-age`` seconds, and stale responses with an
+    ``ETag`` or a ``Last-Modified`` header are revalidated with a conditional
+    request to the app.
+
+    The ``hits``, ``misses`` and ``revalidations`` counters give the number of
+    responses served from the cache, requested to the app, and validated by a
+    ``304 Not Modified`` response from the app.
+
+    """
+    def __init__(self, max_size=DEFAULT_ASSET_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = self.misses = self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Remove all the cached responses and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.revalidations = 0
+
+    def fetch(self, key, get_response):
+        """Return ``(data, headers, status)`` for ``key``.
+
+        ``get_response`` is called with a dict of extra request headers when
+        the response is not in the cache or has to be revalidated. It must
+        return a ``(data, headers, status)`` tuple.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            expires, response = entry
+            if monotonic() < expires:
+                self._count('hits')
+                return response
+            request_headers = {
+                request_header: response[1][header]
+                for header, request_header in VALIDATORS
+                if header in response[1]}
+            if request_headers:
+                new_response = get_response(request_headers)
+                if new_response[2] == 304:
+                    self._count('hits', 'revalidations')
+                    data, headers, status = response
+                    headers = headers.copy()
+                    for header, value in new_response[1].items():
+                        if header.lower() != 'content-length':
+                            headers.set(header, value)
+                    self._store(key, (data, headers, status))
+                    return data, headers, status
+                self._count('misses')
+                self._store(key, new_response)
+                return new_response
+        self._count('misses')
+        response = get_response({})
+        self._store(key, response)
+        return response
+
+    def _count(self, *counters):
+        with self._lock:
+            for counter in counters:
+                setattr(self, counter, getattr(self, counter) + 1)
+
+    def _store(self, key, response):
+        data, headers, status = response
+        cache_control = parse_cache_control_header(
+            headers.get('Cache-Control'), cls=ResponseCacheControl)
+        has_validator = any(header in headers for header, _ in VALIDATORS)
+        max_age = 0 if cache_control.no_cache else (cache_control.max_age or 0)
+        stored = isinstance(data, bytes) and status == 200
+        if not stored or cache_control.no_store or not (max_age or has_validator):
+            with self._lock:
+                self._entries.pop(key, None)
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + max_age, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+def get_asset_cache(app):
+    """Return the :class:`AssetCache` registered for ``app``.
+
+    The cache is created on first use, with at most
+    ``WEASYPRINT_ASSET_CACHE_SIZE`` responses.
+
+    """
+    if 'weasyprint_asset_cache' not in app.extensions:
+        max_size = app.config.get(
+            'WEASYPRINT_ASSET_CACHE_SIZE', DEFAULT_ASSET_CACHE_SIZE)
+        app.extensions['weasyprint_asset_cache'] = AssetCache(max_size)
+    return app.extensions['weasyprint_asset_cache']
+
+
+def _pdf_digest(pdf):
+    """Return the SHA-256 digest of PDF bytes or of a seekable file."""
+    if isinstance(pdf, bytes):
+        return sha256(pdf).hexdigest()
+    hasher = sha256()
+    while chunk := pdf.read(64 * 1024):
+        hasher.update(chunk)
+    pdf.seek(0)
+    return hasher.hexdigest()
+
+
+class _LRUCache:
+    """Thread-safe dict keeping at most ``max_size`` recently used items."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all the cached items."""
+        with self._lock:
+            self._entries.clear()
+
+
+class MemoryPdfCache(_LRUCache):
+    """Bounded LRU cache of rendered PDF files, kept in memory.
+
+    Caches are given to :func:`flask_weasyprint.render_pdf` as ``pdf_cache``.
+    Entries are stored by fingerprint with the digests of the resources used
+    for their layout, and are returned as ``(dependencies, etag, pdf)``
+    tuples.
+
+    """
+    def __init__(self, max_size=DEFAULT_PDF_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def get(self, key):
+        """Return the ``(dependencies, etag, pdf)`` tuple stored for ``key``."""
+        return self._get(key)
+
+    def set(self, key, dependencies, pdf):
+        """Store ``pdf``, bytes or a seekable file, and return its ETag."""
+        etag = _pdf_digest(pdf)
+        if not isinstance(pdf, bytes):
+            data = pdf.read()
+            pdf.seek(0)
+            pdf = data
+        self._set(key, (dict(dependencies), etag, pdf))
+        return etag
+
+
+class FileSystemPdfCache:
+    """Cache of rendered PDF files, stored in a directory.
+
+    Works like :class:`MemoryPdfCache`, but PDF files are returned as open
+    files instead of bytes. PDF files are stored by ETag, identical files are
+    only stored once. Entries are never removed, the directory can be cleaned
+    by external tools.
+
+    """
+    def __init__(self, directory):
+        self.directory = os.fspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, f'{key}.{extension}')
+
+    def get(self, key):
+        """Return the ``(dependencies, etag, pdf)`` tuple stored for ``key``."""
+        try:
+            with open(self._path(key, 'json'), encoding='utf-8') as fd:
+                metadata = json.load(fd)
+            pdf = open(self._path(metadata['etag'], 'pdf'), 'rb')
+        except (OSError, KeyError, ValueError):
+            return
+        return metadata['dependencies'], metadata['etag'], pdf
+
+    def set(self, key, dependencies, pdf):
+        """Store ``pdf``, bytes or a seekable file, and return its ETag."""
+        etag = _pdf_digest(pdf)
+        metadata = {'dependencies': dict(dependencies), 'etag': etag}
+        # Write to temporary files first, so that readers never see partial
+        # entries. The PDF file is written before the metadata referencing it.
+        with NamedTemporaryFile('wb', dir=self.directory, delete=False) as fd:
+            if isinstance(pdf, bytes):
+                fd.write(pdf)
+            else:
+                shutil.copyfileobj(pdf, fd)
+                pdf.seek(0)
+        os.replace(fd.name, self._path(etag, 'pdf'))
+        with NamedTemporaryFile(
+                'w', encoding='utf-8', dir=self.directory, delete=False) as fd:
+            json.dump(metadata, fd)
+        os.replace(fd.name, self._path(key, 'json'))
+        return etag
+
+
+class DocumentCache(_LRUCache):
+    """Bounded LRU cache of laid out documents, kept in memory.
+
+    Caches are given to :func:`flask_weasyprint.render_pdf` as
+    ``document_cache``, so that different page ranges of a document are
+    rendered without laying it out again. Entries are stored by fingerprint
+    with the digests of the resources used for their layout, are returned as
+    ``(dependencies, document)`` tuples, and expire after ``ttl`` seconds,
+    never if :obj:`None`.
+
+    """
+    def __init__(self, max_size=DEFAULT_DOCUMENT_CACHE_SIZE,
+                 ttl=DEFAULT_DOCUMENT_CACHE_TTL):
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key):
+        """Return the ``(dependencies, document)`` tuple stored for ``key``."""
+        if (entry := self._get(key)) is None:
+            return
+        expires, dependencies, document = entry
+        if monotonic() >= expires:
+            with self._lock:
+                self._entries.pop(key, None)
+            return
+        return dependencies, document
+
+    def set(self, key, dependencies, document):
+        """Store the laid out ``document`` with ``dependencies``."""
+        now = monotonic()
+        with self._lock:
+            # Remove expired documents, that can be large.
+            for expired_key in [
+                    entry_key for entry_key, (expires, _, _)
+                    in self._entries.items() if now >= expires]:
+                del self._entries[expired_key]
+        expires = inf if self.ttl is None else now + self.ttl
+        self._set(key, (expires, dict(dependencies), document))
+
+
+class StylesheetCache(_LRUCache):
+    """Bounded LRU cache of parsed stylesheets.
+
+    Stylesheets are stored by source with the digests of the resources used
+    to parse them, and are returned as ``(dependencies, css)`` tuples. As
+    the digests are checked before reusing a stylesheet, changes in the
+    responses of the app, including during development with the reloader,
+    are taken into account.
+
+    """
+    def __init__(self, max_size=DEFAULT_STYLESHEET_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def get(self, key):
+        """Return the ``(dependencies, css)`` tuple stored for ``key``."""
+        return self._get(key)
+
+    def set(self, key, dependencies, css):
+        """Store the ``css`` stylesheet parsed with ``dependencies``."""
+        self._set(key, (dict(dependencies), css))
+
+
+#: The process-wide cache used by :func:`flask_weasyprint.CSS`.
+stylesheet_cache = StylesheetCache()
+
+#: The process-wide cache of laid out :class:`flask_weasyprint.StaticFragment`.
+fragment_cache = DocumentCache(DEFAULT_FRAGMENT_CACHE_SIZE, ttl=None)
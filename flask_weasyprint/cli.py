@@ -0,0 +1,107 @@
+"""Command line interface, available as ``flask weasyprint``."""
+
+import os
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+from urllib.parse import urlsplit
+
+import click
+from flask.cli import AppGroup
+from werkzeug.utils import secure_filename
+
+from .renderer import BatchRenderer, PdfRenderer
+
+cli = AppGroup('weasyprint', help='Generate PDF files with WeasyPrint.')
+
+
+def _filename(url):
+    """Return the name of the PDF file generated for url."""
+    url = urlsplit(url)
+    path = url.path.removesuffix('.pdf').strip('/')
+    name = secure_filename(f'{path}?{url.query}' if url.query else path)
+    return f'{name or "index"}.pdf'
+
+
+def _write(filename, pdf):
+    """Write pdf to filename, atomically."""
+    directory = os.path.dirname(filename)
+    with NamedTemporaryFile('wb', dir=directory, delete=False) as fd:
+        fd.write(pdf)
+    os.replace(fd.name, filename)
+
+
+@cli.command('render')
+@click.argument('urls', nargs=-1)
+@click.option(
+    '-f', '--file', 'urls_file', type=click.File(),
+    help='File including URLs to render, one per line.')
+@click.option(
+    '-o', '--output', type=click.Path(file_okay=False), default='.',
+    show_default=True, help='Directory where PDF files are written.')
+@click.option(
+    '-w', '--workers', type=click.IntRange(1),
+    help='Number of worker processes, defaults to the number of processors.')
+@click.option(
+    '-b', '--batch-size', type=click.IntRange(1),
+    help='Maximum number of documents rendered or kept in memory at once.')
+@click.option(
+    '--resume/--no-resume', default=False,
+    help='Skip URLs whose PDF file already exists in the output directory.')
+def render(urls, urls_file, output, workers, batch_size, resume):
+    """Render URLS of the app to PDF files.
+
+    URLs are relative to the root URL of the app, given by the SERVER_NAME,
+    APPLICATION_ROOT and PREFERRED_URL_SCHEME configuration values. No HTTP
+    requests are made to render documents and their resources served by
+    the app.
+
+    PDF files are named after the URLs paths, URLs giving the same file name
+    are refused. Documents that can’t be rendered are reported and the
+    following documents are rendered anyway.
+
+    """
+    urls = list(urls)
+    if urls_file is not None:
+        urls.extend(line.strip() for line in urls_file if line.strip())
+    if not urls:
+        raise click.UsageError('No URL given.')
+    urls = list(dict.fromkeys(urls))
+
+    filenames, names = {}, {}
+    for url in urls:
+        name = _filename(url)
+        if name in names:
+            raise click.UsageError(
+                f'{names[name]} and {url} are both rendered to {name}.')
+        names[name] = url
+        filenames[url] = os.path.join(output, name)
+    os.makedirs(output, exist_ok=True)
+    skipped = 0
+    if resume:
+        urls = [url for url in urls if not os.path.exists(filenames[url])]
+        skipped = len(filenames) - len(urls)
+
+    renderer = PdfRenderer(max_workers=workers)
+    batch = BatchRenderer(renderer=renderer, max_pending=batch_size)
+    failures, start = [], perf_counter()
+    try:
+        with click.progressbar(length=len(urls), label='Rendering') as bar:
+            for url, pdf in batch.render(urls, return_exceptions=True):
+                if isinstance(pdf, Exception):
+                    failures.append((url, pdf))
+                else:
+                    _write(filenames[url], pdf)
+                bar.update(1)
+    finally:
+        renderer.shutdown()
+    duration = perf_counter() - start
+
+    for url, exception in failures:
+        click.echo(f'Failed to render {url}: {exception}', err=True)
+    rendered = len(urls) - len(failures)
+    speed = rendered / duration if duration else 0
+    click.echo(
+        f'{rendered} PDF files rendered in {duration:.1f}s ({speed:.1f}/s), '
+        f'{len(failures)} failed, {skipped} skipped.')
+    if failures:
+        raise click.exceptions.Exit(1)
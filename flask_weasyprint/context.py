@@ -0,0 +1,61 @@
+"""Information about the requests for which documents are rendered."""
+
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+from flask import current_app, request
+
+
+class RenderContext(NamedTuple):
+    """Request information needed to render documents.
+
+    Render contexts can be given to :func:`flask_weasyprint.HTML`,
+    :func:`flask_weasyprint.CSS`, :func:`flask_weasyprint.make_url_fetcher`
+    and :func:`flask_weasyprint.render_pdf` instead of using the current
+    request. They are immutable and can be pickled, to render documents in
+    other threads or processes, where an :doc:`application context
+    <flask:appcontext>` is still required.
+
+    """
+    #: The URL of the request, used to resolve relative URLs.
+    url: str
+    #: The root path of the app, URLs below are dispatched to the app.
+    script_root: str = ''
+    #: The ``Cookie`` header given to the app, :obj:`None` for no cookie.
+    cookie: str | None = None
+    #: Extra headers given to the app, as ``(name, value)`` tuples. They are
+    #: not taken from the request by :meth:`from_request`.
+    headers: tuple = ()
+
+    @property
+    def scheme(self):
+        """The URL scheme of the request."""
+        return urlsplit(self.url).scheme
+
+    @property
+    def host(self):
+        """The host of the request, including the port if given."""
+        return urlsplit(self.url).netloc
+
+    @classmethod
+    def from_request(cls):
+        """Return the render context of the current request.
+
+        Only the ``Cookie`` header of the request is kept. This requires a
+        Flask :doc:`request context <flask:reqcontext>`.
+
+        """
+        return cls(request.url, request.script_root, request.headers.get('Cookie'))
+
+    @classmethod
+    def from_config(cls, path='/', app=None):
+        """Return a render context for path, without request.
+
+        The root URL is given by the ``SERVER_NAME``, ``APPLICATION_ROOT``
+        and ``PREFERRED_URL_SCHEME`` :doc:`configuration <flask:config>`
+        values of ``app``, the current app by default.
+
+        """
+        app = app or current_app
+        with app.test_request_context(path):
+            return cls.from_request()
@@ -0,0 +1,128 @@
+"""Dispatch URLs to Flask applications."""
+
+from urllib.parse import unquote, urlsplit
+
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.test import EnvironBuilder
+
+from .cache import _LRUCache
+
+DEFAULT_PORTS = (('http', 80), ('https', 443))
+DEFAULT_DISPATCH_CACHE_SIZE = 1024
+# Number of dispatchers kept by app, hosts come from untrusted Host headers.
+MAX_DISPATCHERS = 16
+
+
+def _parse_netloc(netloc):
+    """Return (hostname, port)."""
+    parsed = urlsplit(f'http://{netloc}')
+    return parsed.hostname, parsed.port
+
+
+class FlaskURLDispatcher(_LRUCache):
+    """URL dispatcher to the routes of a Flask app, below a root URL.
+
+    Dispatchers are callables taking a URL and returning either :obj:`None`
+    or an ``(app, base_url, path)`` tuple, see :func:`make_url_fetcher`.
+
+    If ``server_name`` is given, URLs with any scheme are accepted for this
+    domain name or a subdomain thereof. Otherwise, only URLs with the given
+    ``scheme`` and ``host`` are accepted. The decisions for the last
+    ``cache_size`` URLs are kept in memory.
+
+    If ``match_routes`` is :obj:`True`, URLs matching no route of the app
+    are not dispatched, and are fetched by the next fetcher instead of
+    getting a ``404 Not Found`` response from the app.
+
+    Dispatchers are generally created and reused by
+    :func:`make_flask_url_dispatcher`.
+
+    """
+    def __init__(self, app, scheme=None, host=None, root_path='',
+                 server_name=None, match_routes=False,
+                 cache_size=DEFAULT_DISPATCH_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.app = app
+        self.root_path = root_path
+        self.match_routes = match_routes
+        self._scheme = scheme
+        self._subdomains = server_name is not None
+        self._hostname, self._port = _parse_netloc(server_name or host)
+        self._adapters = {}
+
+    def __call__(self, url_string):
+        if isinstance(url_string, bytes):
+            url_string = url_string.decode()
+        if (result := self._get(url_string)) is None:
+            result = (self._dispatch(url_string),)
+            self._set(url_string, result)
+        return result[0]
+
+    def _accept(self, url):
+        if self._subdomains:
+            # Accept any URL scheme; also accept subdomains.
+            return url.hostname is not None and (
+                url.hostname == self._hostname or
+                url.hostname.endswith(f'.{self._hostname}'))
+        # Do not accept subdomains.
+        return (url.scheme, url.hostname) == (self._scheme, self._hostname)
+
+    def _dispatch(self, url_string):
+        url = urlsplit(url_string)
+        url_port = url.port
+        if (url.scheme, url_port) in DEFAULT_PORTS:
+            url_port = None
+        root_path = self.root_path
+        if not (self._accept(url) and url_port == self._port and
+                url.path.startswith(root_path)):
+            return
+        netloc = url.netloc
+        if url.port and not url_port:
+            netloc = netloc.rsplit(':', 1)[0]  # remove default port
+        base_url = f'{url.scheme}://{netloc}{root_path}'
+        path = url.path[len(root_path):]
+        if self.match_routes and not self._matches_route(base_url, path):
+            return
+        if url.query:
+            path = f'{path}?{url.query}'
+        # Ignore url.fragment
+        return self.app, base_url, path
+
+    def _matches_route(self, base_url, path):
+        """Return whether a route of the app matches path."""
+        if base_url not in self._adapters:
+            environ = EnvironBuilder(base_url=base_url).get_environ()
+            self._adapters[base_url] = self.app.create_url_adapter(
+                self.app.request_class(environ))
+        try:
+            self._adapters[base_url].match(unquote(path or '/'), method='GET')
+        except NotFound:
+            return False
+        except HTTPException:
+            pass  # Redirects and other errors are handled by the app
+        return True
+
+
+def get_url_dispatcher(app, scheme=None, host=None, root_path='',
+                       match_routes=False):
+    """Return the :class:`FlaskURLDispatcher` for these parameters.
+
+    Dispatchers are created on first use and stored in the app, for the last
+    16 combinations of parameters. If the app has a ``SERVER_NAME``
+    :doc:`configuration <flask:config>` and ``subdomain_matching`` is set,
+    ``scheme`` and ``host`` are ignored.
+
+    """
+    server_name = app.config.get('SERVER_NAME')
+    if server_name and app.subdomain_matching:
+        scheme = host = None
+    else:
+        server_name = None
+    key = (scheme, host, root_path, server_name, match_routes)
+    dispatchers = app.extensions.setdefault(
+        'weasyprint_dispatchers', _LRUCache(MAX_DISPATCHERS))
+    if (dispatcher := dispatchers._get(key)) is None:
+        dispatcher = FlaskURLDispatcher(
+            app, scheme, host, root_path, server_name, match_routes)
+        dispatchers._set(key, dispatcher)
+    return dispatcher
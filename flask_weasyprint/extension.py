@@ -0,0 +1,165 @@
+"""Flask extension sharing rendering resources between requests."""
+
+from threading import local
+
+from flask import current_app, has_app_context
+
+from .cache import DEFAULT_DOCUMENT_CACHE_TTL, DocumentCache
+from .limiter import DEFAULT_RETRY_AFTER, RenderLimiter, estimate_cost
+from .profiler import RenderProfiler
+
+DEFAULT_CONFIG = (
+    ('WEASYPRINT_FETCHER_CACHE_SIZE', 256),
+    ('WEASYPRINT_SHARED_CACHE', False),
+    ('WEASYPRINT_STATIC_FILES', True),
+    ('WEASYPRINT_MATCH_ROUTES', False),
+    ('WEASYPRINT_MAX_SIZE', None),
+    ('WEASYPRINT_MAX_TOTAL_SIZE', None),
+    ('WEASYPRINT_FORWARDING', None),
+    ('WEASYPRINT_SHARE_FONT_CONFIG', False),
+    ('WEASYPRINT_DOCUMENT_CACHE_SIZE', 0),
+    ('WEASYPRINT_DOCUMENT_CACHE_TTL', DEFAULT_DOCUMENT_CACHE_TTL),
+    ('WEASYPRINT_MAX_RENDERS', None),
+    ('WEASYPRINT_MAX_WAITING_RENDERS', None),
+    ('WEASYPRINT_RENDER_WAIT_TIMEOUT', None),
+    ('WEASYPRINT_RETRY_AFTER', DEFAULT_RETRY_AFTER),
+    ('WEASYPRINT_ESTIMATE_COST', False),
+    ('WEASYPRINT_MAX_RENDER_TIME', None),
+    ('WEASYPRINT_MAX_PAGES', None),
+    ('WEASYPRINT_PROFILE_RATE', 0),
+    ('WEASYPRINT_PROFILE_DIR', None),
+    ('WEASYPRINT_PROFILE_CPU', False),
+    ('WEASYPRINT_PRELOAD', False),
+    ('WEASYPRINT_PRELOAD_STYLESHEETS', ()),
+)
+
+
+class FlaskWeasyPrint:
+    """Flask extension configuring and sharing rendering resources.
+
+    The extension is registered with ``FlaskWeasyPrint(app)``, or with
+    :meth:`init_app` for application factories. :func:`flask_weasyprint.HTML`,
+    :func:`flask_weasyprint.CSS` and :func:`flask_weasyprint.render_pdf` then
+    use the following :doc:`configuration <flask:config>` values:
+
+    ``WEASYPRINT_FETCHER_CACHE_SIZE``, ``WEASYPRINT_SHARED_CACHE``,
+    ``WEASYPRINT_STATIC_FILES``, ``WEASYPRINT_MAX_SIZE``,
+    ``WEASYPRINT_MAX_TOTAL_SIZE`` and ``WEASYPRINT_FORWARDING``
+        The ``cache_size``, ``shared_cache``, ``static_files``, ``max_size``,
+        ``max_total_size`` and ``forwarding`` parameters of
+        :func:`flask_weasyprint.make_url_fetcher`.
+    ``WEASYPRINT_MATCH_ROUTES``
+        The ``match_routes`` parameter of
+        :func:`flask_weasyprint.make_flask_url_dispatcher`.
+    ``WEASYPRINT_SHARE_FONT_CONFIG``
+        Whether documents rendered by :func:`flask_weasyprint.render_pdf`
+        reuse the same :attr:`font_config`, instead of loading the fonts for
+        each document. Disabled by default: fonts defined by ``@font-face``
+        rules are then kept for the lifetime of the thread and available to
+        the following documents, it should only be enabled when documents
+        don’t define different fonts with the same name.
+    ``WEASYPRINT_DOCUMENT_CACHE_SIZE`` and ``WEASYPRINT_DOCUMENT_CACHE_TTL``
+        The size and the time to live of :attr:`document_cache`, disabled
+        when the size is ``0``.
+    ``WEASYPRINT_MAX_RENDERS``, ``WEASYPRINT_MAX_WAITING_RENDERS``,
+    ``WEASYPRINT_RENDER_WAIT_TIMEOUT``, ``WEASYPRINT_RETRY_AFTER``,
+    ``WEASYPRINT_MAX_RENDER_TIME`` and ``WEASYPRINT_MAX_PAGES``
+        The ``max_renders``, ``max_waiting``, ``timeout``, ``retry_after``,
+        ``max_duration`` and ``max_pages`` parameters of :attr:`limiter`,
+        enabled when one of the limits is set.
+    ``WEASYPRINT_ESTIMATE_COST``
+        Whether :attr:`limiter` uses :func:`flask_weasyprint.estimate_cost`
+        to give more render slots to larger documents.
+    ``WEASYPRINT_PROFILE_RATE``, ``WEASYPRINT_PROFILE_DIR`` and
+    ``WEASYPRINT_PROFILE_CPU``
+        The ``rate``, ``directory`` and ``cpu`` parameters of
+        :attr:`profiler`, enabled when the rate is not ``0``.
+    ``WEASYPRINT_PRELOAD`` and ``WEASYPRINT_PRELOAD_STYLESHEETS``
+        Whether :func:`flask_weasyprint.preload` is called with these
+        stylesheets when the extension is registered.
+
+    """
+    def __init__(self, app=None):
+        self._local = local()
+        #: The :class:`flask_weasyprint.DocumentCache` used by default by
+        #: :func:`flask_weasyprint.render_pdf`, if enabled.
+        self.document_cache = None
+        #: The :class:`flask_weasyprint.RenderLimiter` used by default by
+        #: :func:`flask_weasyprint.render_pdf`, if enabled.
+        self.limiter = None
+        #: The :class:`flask_weasyprint.RenderProfiler` used by default by
+        #: :func:`flask_weasyprint.render_pdf`, if enabled.
+        self.profiler = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the extension for ``app``."""
+        for key, value in DEFAULT_CONFIG:
+            app.config.setdefault(key, value)
+        app.extensions['weasyprint'] = self
+        if size := app.config['WEASYPRINT_DOCUMENT_CACHE_SIZE']:
+            self.document_cache = DocumentCache(
+                size, app.config['WEASYPRINT_DOCUMENT_CACHE_TTL'])
+        limits = ('RENDERS', 'RENDER_TIME', 'PAGES')
+        if any(app.config[f'WEASYPRINT_MAX_{limit}'] for limit in limits):
+            self.limiter = RenderLimiter(
+                app.config['WEASYPRINT_MAX_RENDERS'],
+                app.config['WEASYPRINT_MAX_WAITING_RENDERS'],
+                app.config['WEASYPRINT_RENDER_WAIT_TIMEOUT'],
+                app.config['WEASYPRINT_RETRY_AFTER'],
+                estimate_cost if app.config['WEASYPRINT_ESTIMATE_COST'] else None,
+                app.config['WEASYPRINT_MAX_RENDER_TIME'],
+                app.config['WEASYPRINT_MAX_PAGES'])
+        if rate := app.config['WEASYPRINT_PROFILE_RATE']:
+            self.profiler = RenderProfiler(
+                app.config['WEASYPRINT_PROFILE_DIR'], rate,
+                app.config['WEASYPRINT_PROFILE_CPU'])
+        if app.config['WEASYPRINT_PRELOAD']:
+            from . import preload
+
+            self.font_config  # Load fonts in the thread creating the app
+            preload(app.config['WEASYPRINT_PRELOAD_STYLESHEETS'], app=app)
+
+    @property
+    def font_config(self):
+        """The :class:`weasyprint.text.fonts.FontConfiguration` of the thread.
+
+        Font configurations are not thread-safe, each thread has its own.
+
+        """
+        if not hasattr(self._local, 'font_config'):
+            from weasyprint.text.fonts import FontConfiguration  # lazy loading
+
+            self._local.font_config = FontConfiguration()
+        return self._local.font_config
+
+    def fetcher_options(self, app, context):
+        """Return the keyword arguments given to ``make_url_fetcher``."""
+        options = {
+            'cache_size': app.config['WEASYPRINT_FETCHER_CACHE_SIZE'],
+            'shared_cache': app.config['WEASYPRINT_SHARED_CACHE'],
+            'static_files': app.config['WEASYPRINT_STATIC_FILES'],
+            'max_size': app.config['WEASYPRINT_MAX_SIZE'],
+            'max_total_size': app.config['WEASYPRINT_MAX_TOTAL_SIZE'],
+            'forwarding': app.config['WEASYPRINT_FORWARDING']}
+        if app.config['WEASYPRINT_MATCH_ROUTES']:
+            from . import make_flask_url_dispatcher
+
+            options['dispatcher'] = make_flask_url_dispatcher(
+                match_routes=True, context=context)
+        return options
+
+
+def get_extension(app=None):
+    """Return the :class:`FlaskWeasyPrint` extension of ``app``, if any.
+
+    ``app`` is the current app by default, :obj:`None` is returned without
+    application context.
+
+    """
+    if app is None:
+        if not has_app_context():
+            return
+        app = current_app
+    return app.extensions.get('weasyprint')
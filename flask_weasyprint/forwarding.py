@@ -0,0 +1,100 @@
+"""Select the cookies and headers given to apps by URL fetchers."""
+
+from urllib.parse import unquote
+
+from werkzeug.exceptions import HTTPException
+
+
+def public_view(view):
+    """Decorator marking a view whose responses don’t depend on identity.
+
+    URL fetchers using a :class:`ForwardingPolicy` give no cookie and no
+    header to public views, their responses can then be cached and shared
+    between users.
+
+    """
+    view.weasyprint_public = True
+    return view
+
+
+class ForwardingPolicy:
+    """Policy selecting the cookies and headers given to apps by URL fetchers.
+
+    Policies are given to :func:`flask_weasyprint.make_url_fetcher` as
+    ``forwarding``. Without policy, the ``Cookie`` header of the current
+    request and the ``cookie`` and ``headers`` of the render context are
+    given to the app. Other headers of the current request are never given
+    to the app, extra headers are only given by a
+    :class:`flask_weasyprint.RenderContext` built with ``headers``.
+
+    :param cookies:
+        The names of the cookies given to the app, all by default.
+    :param headers:
+        The names of the ``headers`` of the render context given to the app,
+        all by default.
+    :param dict rules:
+        :class:`ForwardingPolicy` objects used instead of this policy for
+        some endpoints, by endpoint or blueprint name.
+    :param public:
+        The names of the endpoints and blueprints whose responses don’t depend
+        on identity, that get no cookie and no header, as views decorated
+        with :func:`public_view`.
+
+    Responses are cached by the URL fetchers and by
+    :class:`flask_weasyprint.AssetCache` with the cookies and headers given
+    to the app: responses of public endpoints are shared between users.
+
+    """
+    def __init__(self, cookies=None, headers=None, rules=None, public=()):
+        self.cookies = None if cookies is None else frozenset(cookies)
+        self.headers = None if headers is None else frozenset(
+            header.lower() for header in headers)
+        self.rules = rules or {}
+        self.public = frozenset(public)
+
+    def forward(self, app, adapter, path, cookie, headers):
+        """Return the ``(cookie, headers)`` given to app for path.
+
+        ``adapter`` is the URL adapter of the app, used to find the endpoint
+        of path, :obj:`None` if the app is not a Flask app.
+
+        """
+        endpoint = None
+        if adapter is not None:
+            try:
+                endpoint, _ = adapter.match(
+                    unquote(path.partition('?')[0] or '/'), method='GET')
+            except HTTPException:
+                pass  # Errors are handled by the app
+        policy = self._policy(app, endpoint)
+        if policy is None:
+            return None, ()
+        return policy._filter(cookie, headers)
+
+    def _policy(self, app, endpoint):
+        """Return the policy of endpoint, None if public."""
+        if endpoint is None:
+            return self
+        if getattr(app.view_functions.get(endpoint), 'weasyprint_public', False):
+            return
+        # Endpoint, then blueprints from the innermost to the outermost.
+        names = endpoint.split('.')
+        for index in range(len(names), 0, -1):
+            name = '.'.join(names[:index])
+            if name in self.public:
+                return
+            if name in self.rules:
+                return self.rules[name]
+        return self
+
+    def _filter(self, cookie, headers):
+        """Return the allowed cookies and headers."""
+        if cookie and self.cookies is not None:
+            cookie = '; '.join(
+                part for part in (part.strip() for part in cookie.split(';'))
+                if part.partition('=')[0].strip() in self.cookies) or None
+        if self.headers is not None:
+            headers = tuple(
+                (name, value) for name, value in headers
+                if name.lower() in self.headers)
+        return cookie, headers
@@ -0,0 +1,135 @@
+"""Static fragments of documents, laid out once."""
+
+from hashlib import sha256
+from typing import NamedTuple
+
+from .cache import fragment_cache
+from .rendering import _arguments, _dependencies_match, _fingerprint, _layout
+
+
+class StaticFragment(NamedTuple):
+    """Static part of documents, such as a cover page or terms and conditions.
+
+    Fragments are given to :func:`flask_weasyprint.render_pdf` as ``before``
+    and ``after``, their pages are inserted before or after the pages of the
+    document. ``url`` or ``string`` is the HTML source of the fragment, and
+    ``stylesheets`` a tuple of stylesheet URLs, relative to the current
+    request as for :func:`flask_weasyprint.HTML`.
+
+    Laid out fragments are kept in :data:`flask_weasyprint.fragment_cache`,
+    by fingerprint of their source, stylesheets, options and first page
+    number, and are reused while the resources used for their layout don’t
+    change. Page numbers follow each other in fragments and documents, but
+    ``counter(pages)`` only counts the pages of each part. Bookmarks and
+    internal links are kept.
+
+    """
+    #: The URL of the HTML source.
+    url: str | None = None
+    #: The HTML source, if no URL is given.
+    string: str | None = None
+    #: The URLs of the stylesheets of the fragment.
+    stylesheets: tuple = ()
+
+
+def _numbering(start, make_css):
+    """Return a stylesheet numbering pages from start."""
+    return make_css(string=f'@page :first {{ counter-reset: page {start - 1} }}')
+
+
+class _Fragment:
+    """Static fragment prepared for a render, laid out when needed."""
+    def __init__(self, fragment, url, make_css, make_url_fetcher):
+        from weasyprint import HTML  # lazy loading
+
+        self.make_css = make_css
+        self.url_fetcher = make_url_fetcher()
+        self.url_fetcher.fetched = {}
+        args = () if fragment.url is None else (fragment.url,)
+        kwargs = {} if fragment.string is None else {'string': fragment.string}
+        guess, _, kwargs = _arguments(args, kwargs, url)
+        self.html = HTML(guess, url_fetcher=self.url_fetcher, **kwargs)
+        self.stylesheets = [make_css(url) for url in fragment.stylesheets]
+
+    def pages(self, start, options, font_config, dependencies):
+        """Return the pages of the fragment, numbered from start.
+
+        The digests of the resources used for the layout are added to
+        dependencies.
+
+        """
+        stylesheets = self.stylesheets
+        if start > 1:
+            stylesheets = [*stylesheets, _numbering(start, self.make_css)]
+        key = _fingerprint(self.html, stylesheets, options)
+        if key is not None and (entry := fragment_cache.get(key)):
+            if _dependencies_match(self.url_fetcher, entry[0]):
+                dependencies.update(entry[0])
+                return entry[1].pages
+        if font_config is not None:
+            options = {**options, 'font_config': font_config}
+        document = _layout(self.html, stylesheets, options)
+        if key is not None:
+            fragment_cache.set(key, self.url_fetcher.fetched, document)
+        dependencies.update(self.url_fetcher.fetched)
+        return document.pages
+
+
+class _Stitcher:
+    """Add the pages of static fragments around the pages of a document.
+
+    Creating a stitcher is cheap, fragments are only fetched and laid out by
+    :meth:`prepare`. ``make_css`` and ``make_url_fetcher`` create the
+    stylesheets and the URL fetchers of the fragments, for the request at
+    ``url``.
+
+    """
+    def __init__(self, before, after, options, url, make_css, make_url_fetcher,
+                 font_config=None):
+        self.fragments = (tuple(before), tuple(after))
+        self.options = options
+        self.url = url
+        self.make_css = make_css
+        self.make_url_fetcher = make_url_fetcher
+        self.font_config = font_config
+        # Digests of the resources used to lay out the fragments.
+        self.dependencies = {}
+        self.before = self.after = None
+        self.before_pages = []
+
+    @property
+    def key(self):
+        """Fingerprint of the fragments and of the URL they are relative to."""
+        return sha256(repr((self.url, self.fragments)).encode()).hexdigest()
+
+    def _pages(self, fragment, previous_pages):
+        return fragment.pages(
+            len(previous_pages) + 1, self.options, self.font_config,
+            self.dependencies)
+
+    def _prepare(self, fragments):
+        return [
+            _Fragment(fragment, self.url, self.make_css, self.make_url_fetcher)
+            for fragment in fragments]
+
+    def prepare(self, stylesheets):
+        """Lay out the fragments before the document.
+
+        Return stylesheets numbering the pages of the document.
+
+        """
+        before, after = self.fragments
+        self.before, self.after = self._prepare(before), self._prepare(after)
+        for fragment in self.before:
+            self.before_pages.extend(self._pages(fragment, self.before_pages))
+        if not self.before_pages:
+            return stylesheets
+        start = len(self.before_pages) + 1
+        return [*(stylesheets or ()), _numbering(start, self.make_css)]
+
+    def stitch(self, pages):
+        """Return the list of pages with the pages of the fragments."""
+        pages = [*self.before_pages, *pages]
+        for fragment in self.after:
+            pages.extend(self._pages(fragment, pages))
+        return pages
@@ -0,0 +1,93 @@
+"""Reduce the size of fetched images before rendering."""
+
+from email.message import EmailMessage
+from hashlib import file_digest, sha256
+from io import BytesIO
+
+from .cache import _LRUCache
+
+DEFAULT_IMAGE_CACHE_SIZE = 256
+FORMATS = {'image/jpeg': 'JPEG', 'image/png': 'PNG'}
+
+
+class ImageDownscaler(_LRUCache):
+    """Fetch processor downscaling and recompressing large raster images.
+
+    Processors are given to :func:`flask_weasyprint.make_url_fetcher` as
+    ``processors``. JPEG and PNG images larger than ``max_width`` and
+    ``max_height`` CSS pixels at ``dpi`` dots per inch are resized to fit in
+    this size, keeping their aspect ratio. The default size is an A4 page,
+    images always displayed at a smaller size can be downscaled further by
+    giving a smaller size.
+
+    Resized JPEG images are compressed with the ``jpeg_quality`` quality,
+    between 0 and 95, resized PNG images are optimized. Images are left
+    unchanged when their processed version is not smaller. Processed images
+    are kept in memory by SHA-256 digest, for the last ``cache_size`` images.
+
+    Images are processed with `Pillow <https://python-pillow.org/>`_.
+
+    """
+    def __init__(self, dpi=300, max_width=794, max_height=1123,
+                 jpeg_quality=85, cache_size=DEFAULT_IMAGE_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.dpi = dpi
+        self.max_width = max_width
+        self.max_height = max_height
+        self.jpeg_quality = jpeg_quality
+
+    def __call__(self, url, data, headers):
+        if headers.get_content_type() not in FORMATS:
+            return
+        # Large images are spooled to temporary files, read them in place.
+        if isinstance(data, bytes):
+            key, size = sha256(data).digest(), len(data)
+        else:
+            key, size = file_digest(data, 'sha256').digest(), data.tell()
+        if (result := self._get(key)) is None:
+            source = BytesIO(data) if isinstance(data, bytes) else data
+            source.seek(0)
+            try:
+                result = (
+                    self._process(source, size, headers.get_content_type()),)
+            except Exception:
+                result = (None,)  # Let WeasyPrint handle invalid images
+            self._set(key, result)
+        if result[0] is None:
+            if not isinstance(data, bytes):
+                data.seek(0)
+            return data, headers
+        if not isinstance(data, bytes):
+            data.close()
+        processed_headers = EmailMessage()
+        for name, value in headers.items():
+            if name.lower() != 'content-length':
+                processed_headers[name] = value
+        return result[0], processed_headers
+
+    def _process(self, source, size, content_type):
+        """Return the processed image, or None if it can’t be reduced."""
+        from PIL import Image, ImageOps  # lazy loading
+
+        width, height = (
+            round(size * self.dpi / 96) for size in (self.max_width, self.max_height))
+        with Image.open(source) as image:
+            if image.format != FORMATS[content_type]:
+                return
+            if getattr(image, 'is_animated', False):
+                return
+            if image.width <= width and image.height <= height:
+                return
+            icc_profile = image.info.get('icc_profile')
+            # Apply EXIF orientation, as EXIF data is not kept.
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((width, height), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            if content_type == 'image/jpeg':
+                image.save(
+                    output, 'JPEG', quality=self.jpeg_quality, optimize=True,
+                    icc_profile=icc_profile)
+            else:
+                image.save(output, 'PNG', optimize=True, icc_profile=icc_profile)
+        if output.tell() < size:
+            return output.getvalue()
@@ -0,0 +1,212 @@
+"""Limit the resources used to render PDF documents."""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Condition, Lock
+from time import perf_counter
+
+from werkzeug.exceptions import ServiceUnavailable
+
+DEFAULT_RETRY_AFTER = 5
+# Number of HTML elements costing one render slot, see estimate_cost.
+ELEMENTS_PER_SLOT = 5000
+# Number of HTML elements a subresource costs as much as, see estimate_cost.
+SUBRESOURCE_COST = 50
+
+# Budget of the PDF being rendered, checked by _BudgetFilter.
+_current_budget = ContextVar('flask_weasyprint_budget', default=None)
+# Filter installed while documents with a budget are rendered.
+_budget_filter = None
+_filter_lock = Lock()
+
+
+class RenderLimitError(ServiceUnavailable):
+    """Raised when a document can’t be rendered within the render limits.
+
+    Flask responds with a ``503 Service Unavailable`` error, including a
+    ``Retry-After`` header when the renderer is saturated.
+
+    """
+
+
+def estimate_cost(html):
+    """Return the cost of rendering a :class:`weasyprint.HTML` object.
+
+    The cost is the number of render slots needed by the document, given by
+    its number of elements and of subresources.
+
+    """
+    from . import _html_subresources  # lazy loading
+
+    elements = sum(1 for _ in html.etree_element.iter())
+    subresources = len(_html_subresources(html))
+    return 1 + (elements + SUBRESOURCE_COST * subresources) // ELEMENTS_PER_SLOT
+
+
+class _Budget:
+    """Wall-clock and page budget of a render."""
+    def __init__(self, max_duration, max_pages):
+        self.max_duration = max_duration
+        self.max_pages = max_pages
+        self.start = perf_counter()
+
+    def check(self, record):
+        """Raise RenderLimitError if the budget is exceeded at record."""
+        if self.max_duration is not None:
+            if perf_counter() - self.start > self.max_duration:
+                raise RenderLimitError(
+                    f'Document not rendered in {self.max_duration} seconds')
+        if self.max_pages is not None and record.msg.startswith(
+                'Step 5 - Creating layout - Page'):
+            if record.args[0] > self.max_pages:
+                raise RenderLimitError(
+                    f'Document longer than {self.max_pages} pages')
+
+
+class _BudgetFilter(logging.Filter):
+    """Filter of WeasyPrint’s progress logger checking render budgets.
+
+    Progress messages are sent between rendering steps and for each laid out
+    page. They are filtered as with the original level of the logger, set
+    back when the filter is removed.
+
+    """
+    def __init__(self, level, effective_level):
+        super().__init__()
+        self.level = level
+        self.effective_level = effective_level
+        self.renders = 0
+
+    def filter(self, record):
+        if (budget := _current_budget.get()) is not None:
+            budget.check(record)
+        return record.levelno >= self.effective_level
+
+
+@contextmanager
+def _progress_messages():
+    """Get progress messages from WeasyPrint, to check render budgets.
+
+    The level of the progress logger is lowered while documents with a budget
+    are rendered, and set back when the last one ends.
+
+    """
+    from weasyprint.logger import PROGRESS_LOGGER  # lazy loading
+
+    global _budget_filter
+    with _filter_lock:
+        if _budget_filter is None:
+            _budget_filter = _BudgetFilter(
+                PROGRESS_LOGGER.level, PROGRESS_LOGGER.getEffectiveLevel())
+            PROGRESS_LOGGER.addFilter(_budget_filter)
+            PROGRESS_LOGGER.setLevel(logging.INFO)
+        _budget_filter.renders += 1
+    try:
+        yield
+    finally:
+        with _filter_lock:
+            _budget_filter.renders -= 1
+            if not _budget_filter.renders:
+                PROGRESS_LOGGER.removeFilter(_budget_filter)
+                PROGRESS_LOGGER.setLevel(_budget_filter.level)
+                _budget_filter = None
+
+
+class RenderLimiter:
+    """Admission control for the PDF documents rendered by a process.
+
+    :param int max_renders:
+        The maximum number of render slots used at the same time, unlimited
+        if :obj:`None`. Documents use one slot each, unless ``cost`` is
+        given.
+    :param int max_waiting:
+        The maximum number of documents waiting for a slot, unlimited by
+        default.
+    :param float timeout:
+        The number of seconds documents wait for a slot, forever by default.
+    :param int retry_after:
+        The number of seconds given in the ``Retry-After`` header of
+        responses when documents can’t wait for a slot.
+    :param cost:
+        A callable returning the number of slots used by a
+        :class:`weasyprint.HTML` object, such as :func:`estimate_cost`.
+    :param float max_duration:
+        The maximum number of seconds spent laying out and writing a
+        document, unlimited by default.
+    :param int max_pages:
+        The maximum number of pages of a document, unlimited by default.
+
+    :class:`RenderLimitError` is raised when documents can’t wait for a slot
+    or exceed their budget. Budgets are checked between rendering steps and
+    for each page, documents are stopped at the next check.
+
+    """
+    def __init__(self, max_renders=None, max_waiting=None, timeout=None,
+                 retry_after=DEFAULT_RETRY_AFTER, cost=None, max_duration=None,
+                 max_pages=None):
+        self.max_renders = max_renders
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.cost = cost
+        self.max_duration = max_duration
+        self.max_pages = max_pages
+        self._used = self._waiting = 0
+        self._condition = Condition()
+
+    @property
+    def used(self):
+        """The number of slots used by documents being rendered."""
+        return self._used
+
+    @property
+    def waiting(self):
+        """The number of documents waiting for a slot."""
+        return self._waiting
+
+    @contextmanager
+    def limit(self, html):
+        """Context manager rendering html when a slot is available."""
+        cost = 1 if self.cost is None else max(1, self.cost(html))
+        if self.max_renders is not None:
+            cost = min(cost, self.max_renders)
+        self._acquire(cost)
+        try:
+            if self.max_duration is None and self.max_pages is None:
+                yield
+                return
+            with _progress_messages():
+                token = _current_budget.set(
+                    _Budget(self.max_duration, self.max_pages))
+                try:
+                    yield
+                finally:
+                    _current_budget.reset(token)
+        finally:
+            with self._condition:
+                self._used -= cost
+                self._condition.notify_all()
+
+    def _acquire(self, cost):
+        def available():
+            return (
+                self.max_renders is None or
+                self._used + cost <= self.max_renders)
+
+        with self._condition:
+            if not available():
+                if self.max_waiting is not None:
+                    if self._waiting >= self.max_waiting:
+                        raise RenderLimitError(
+                            'Too many documents waiting to be rendered',
+                            retry_after=self.retry_after)
+                self._waiting += 1
+                try:
+                    if not self._condition.wait_for(available, self.timeout):
+                        raise RenderLimitError(
+                            'Too many documents being rendered',
+                            retry_after=self.retry_after)
+                finally:
+                    self._waiting -= 1
+            self._used += cost
@@ -0,0 +1,191 @@
+"""Fetch external resources with persistent HTTP connections.
+
+This module imports WeasyPrint, it is not imported by
+:mod:`flask_weasyprint`.
+
+"""
+
+import http.client
+from collections import defaultdict
+from io import BytesIO
+from threading import BoundedSemaphore, Lock
+from urllib.error import URLError
+from urllib.request import BaseHandler
+from urllib.response import addinfourl
+
+from weasyprint.urls import URLFetcher
+
+DEFAULT_MAX_IDLE_PER_HOST = 4
+READ_CHUNK_SIZE = 64 * 1024
+
+# Errors raised when reusing connections closed by servers.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected, http.client.CannotSendRequest,
+    BrokenPipeError, ConnectionResetError)
+
+
+class ConnectionPool:
+    """Pool of persistent HTTP and HTTPS connections, by host.
+
+    :param float timeout:
+        The number of seconds before requests are dropped, defaults to the
+        timeout of the URL fetcher.
+    :param int max_size:
+        The maximum size of response bodies in bytes, unlimited by default.
+    :param int max_connections:
+        The maximum number of requests made at the same time, unlimited by
+        default.
+    :param int max_idle_per_host:
+        The maximum number of idle connections kept open for each host.
+    :param ssl.SSLContext ssl_context:
+        The SSL context used for HTTPS connections.
+
+    """
+    def __init__(self, timeout=None, max_size=None, max_connections=None,
+                 max_idle_per_host=DEFAULT_MAX_IDLE_PER_HOST, ssl_context=None):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_idle_per_host = max_idle_per_host
+        self.ssl_context = ssl_context
+        self._slots = None
+        if max_connections is not None:
+            self._slots = BoundedSemaphore(max_connections)
+        self._idle = defaultdict(list)
+        self._lock = Lock()
+
+    def __len__(self):
+        return sum(len(connections) for connections in self._idle.values())
+
+    def clear(self):
+        """Close all the idle connections."""
+        with self._lock:
+            connections = [
+                connection for connections in self._idle.values()
+                for connection in connections]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+    def _connect(self, scheme, host, timeout):
+        if scheme == 'https':
+            return http.client.HTTPSConnection(
+                host, timeout=timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(host, timeout=timeout)
+
+    def _acquire(self, key, timeout):
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop(), True
+        return self._connect(*key, timeout), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle_per_host:
+                self._idle[key].append(connection)
+                return
+        connection.close()
+
+    def request(self, req, timeout=None):
+        """Send a :class:`urllib.request.Request`, return its response.
+
+        The response body is read, so that the connection can be reused.
+
+        """
+        if self._slots:
+            self._slots.acquire()
+        try:
+            return self._request(req, timeout)
+        finally:
+            if self._slots:
+                self._slots.release()
+
+    def _request(self, req, timeout):
+        timeout = self.timeout if self.timeout is not None else timeout
+        key = (req.type, req.host)
+        headers = {**req.headers, **req.unredirected_hdrs}
+        headers.pop('Connection', None)
+        while True:
+            connection, reused = self._acquire(key, timeout)
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request(
+                    req.get_method(), req.selector, req.data, headers)
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused:
+                    continue  # Retry with another connection
+                raise
+            except OSError as exception:
+                connection.close()
+                raise URLError(exception) from exception
+            except BaseException:
+                connection.close()
+                raise
+            break
+        try:
+            data = self._read(response)
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        result = addinfourl(
+            BytesIO(data), response.headers, req.full_url, response.status)
+        result.msg = response.reason
+        return result
+
+    def _read(self, response):
+        if self.max_size is None:
+            return response.read()
+        length = response.getheader('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_size:
+            raise ValueError(f'Response larger than {self.max_size} bytes')
+        chunks, size = [], 0
+        while chunk := response.read(min(READ_CHUNK_SIZE, self.max_size + 1)):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self.max_size:
+                raise ValueError(f'Response larger than {self.max_size} bytes')
+        return b''.join(chunks)
+
+
+class PooledHTTPHandler(BaseHandler):
+    """:mod:`urllib` handler sending HTTP requests with a :class:`ConnectionPool`.
+
+    Requests sent through proxies are left to other handlers.
+
+    """
+    handler_order = 400  # Before urllib’s default handlers
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def http_open(self, req):
+        if not req.has_proxy():
+            return self.pool.request(req, req.timeout)
+
+    https_open = http_open
+
+
+class PooledURLFetcher(URLFetcher):
+    """URL fetcher reusing HTTP connections between requests.
+
+    Connections are kept in :attr:`pool`, shared by all the instances of the
+    class. Subclasses can define their own :class:`ConnectionPool` to
+    configure timeouts, size limits and concurrency.
+
+    The class can be given as ``next_fetcher`` to
+    :func:`flask_weasyprint.make_url_fetcher`.
+
+    """
+    #: The :class:`ConnectionPool` used by the instances of the class.
+    pool = ConnectionPool()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.add_handler(PooledHTTPHandler(self.pool))
@@ -0,0 +1,187 @@
+"""Profile the memory and the time used to render PDF documents."""
+
+import json
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from random import random
+from threading import Lock
+from typing import NamedTuple
+from uuid import uuid4
+
+from flask import current_app, has_app_context
+
+from .stats import RenderStats, current_stats, pdf_profiled
+
+DEFAULT_TOP_ALLOCATIONS = 20
+DEFAULT_TRACEBACK_FRAMES = 1
+
+# tracemalloc and cProfile trace the whole process, one render at a time.
+_profile_lock = Lock()
+
+
+def _snapshot():
+    """Return a snapshot of the traced memory, without profiler traces."""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)))
+
+
+class AllocationSite(NamedTuple):
+    """Memory allocated by a line of code during a profiled render."""
+
+    #: The file of the code.
+    filename: str
+    #: The line number of the code.
+    lineno: int
+    #: The size of the memory allocated and still used at the end, in bytes.
+    size: int
+    #: The number of allocated blocks still used at the end.
+    count: int
+
+
+class RenderProfile:
+    """Memory and time profile of a rendered document."""
+    def __init__(self, stats):
+        #: The unique identifier of the profile, used to name report files.
+        self.id = uuid4().hex
+        #: The URL of the document, if known.
+        self.url = None
+        #: The :class:`flask_weasyprint.RenderStats` of the document.
+        self.stats = stats
+        #: The peak size of the memory allocated during the render, in bytes.
+        self.peak_memory = None
+        #: The list of :class:`AllocationSite` using the most memory.
+        self.allocations = []
+        #: The :class:`pstats.Stats` of the render, if CPU is profiled.
+        self.cpu = None
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id} peak={self.peak_memory}>'
+
+    def as_dict(self):
+        """Return the profile as a JSON-serializable dict."""
+        return {
+            'id': self.id,
+            'url': self.url,
+            'peak_memory': self.peak_memory,
+            'pdf_size': self.stats.pdf_size,
+            'cached': self.stats.cached,
+            'times': {
+                'html': self.stats.html_time,
+                'fetch': self.stats.fetch_time,
+                'layout': self.stats.layout_time,
+                'pdf': self.stats.pdf_time,
+            },
+            'fetches': [record._asdict() for record in self.stats.fetches],
+            'allocations': [site._asdict() for site in self.allocations],
+        }
+
+    def write(self, directory):
+        """Write the profile to directory, as JSON and pstats files."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with (directory / f'{self.id}.json').open('w') as fd:
+            json.dump(self.as_dict(), fd, indent=2)
+        if self.cpu is not None:
+            self.cpu.dump_stats(directory / f'{self.id}.pstats')
+
+
+class RenderProfiler:
+    """Opt-in profiler of the memory and the time used to render documents.
+
+    Profilers are given to :func:`flask_weasyprint.render_pdf` and
+    :func:`flask_weasyprint.HTML` as ``profiler``. A ``rate`` fraction of the
+    documents is profiled, randomly sampled, so that profilers can be used in
+    production at low rates.
+
+    The memory is traced by :mod:`tracemalloc`, recording the peak memory
+    used by renders and the ``top`` lines of code allocating memory still
+    used at their end. If ``cpu`` is :obj:`True`, the time is profiled by
+    :mod:`cProfile` too.
+
+    Profiles of rendered documents are :class:`RenderProfile` objects, also
+    including the fetched resources and the size of the PDF. They are sent
+    with the :data:`flask_weasyprint.pdf_profiled` signal, and written to
+    ``directory`` if given, as JSON files and :mod:`pstats` files named by
+    profile identifier.
+
+    Tracing slows renders down. The whole process is traced, documents are
+    profiled one at a time and documents rendered meanwhile in other threads
+    are not sampled.
+
+    """
+    def __init__(self, directory=None, rate=1, cpu=False,
+                 top=DEFAULT_TOP_ALLOCATIONS, frames=DEFAULT_TRACEBACK_FRAMES):
+        self.directory = directory
+        self.rate = rate
+        self.cpu = cpu
+        self.top = top
+        self.frames = frames
+
+    @contextmanager
+    def profile(self, stats=None):
+        """Context manager profiling the render of a document.
+
+        ``stats`` is the :class:`flask_weasyprint.RenderStats` of the
+        document, created and used by the fetchers created meanwhile if not
+        given. The :class:`RenderProfile` is given by the context manager,
+        :obj:`None` if the document is not sampled.
+
+        """
+        if random() >= self.rate or not _profile_lock.acquire(blocking=False):
+            yield
+            return
+        token = None
+        if stats is None:
+            stats = RenderStats()
+            token = current_stats.set(stats)
+        profile = RenderProfile(stats)
+        try:
+            with self._trace(profile):
+                yield profile
+        finally:
+            if token is not None:
+                current_stats.reset(token)
+            _profile_lock.release()
+        if self.directory is not None:
+            profile.write(self.directory)
+        if has_app_context():
+            pdf_profiled.send(current_app._get_current_object(), profile=profile)
+
+    @contextmanager
+    def _trace(self, profile):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        snapshot = _snapshot()
+        cpu = None
+        if self.cpu:
+            from cProfile import Profile
+
+            cpu = Profile()
+            cpu.enable()
+        try:
+            yield
+        finally:
+            if cpu is not None:
+                cpu.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            differences = _snapshot().compare_to(snapshot, 'lineno')
+            if started:
+                tracemalloc.stop()
+        profile.peak_memory = peak - baseline
+        profile.allocations = [
+            AllocationSite(
+                difference.traceback[0].filename,
+                difference.traceback[0].lineno, difference.size_diff,
+                difference.count_diff)
+            for difference in sorted(
+                differences, key=lambda difference: -difference.size_diff)
+            if difference.size_diff > 0][:self.top]
+        if cpu is not None:
+            from pstats import Stats
+
+            profile.cpu = Stats(cpu)
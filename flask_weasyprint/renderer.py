@@ -0,0 +1,304 @@
+"""Render PDF documents in worker processes."""
+
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from hashlib import sha256
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urljoin
+
+from flask import current_app, has_request_context, render_template, request
+from werkzeug.exceptions import ServiceUnavailable
+
+from .cache import StylesheetCache
+from .limiter import DEFAULT_RETRY_AFTER
+
+DEFAULT_BATCH_CACHE_SIZE = 4096
+
+# Stylesheets parsed by a worker process, shared by the documents it renders.
+_worker_stylesheets = StylesheetCache()
+
+
+class RendererBusyError(ServiceUnavailable):
+    """Raised when the queue of a :class:`PdfRenderer` is full.
+
+    Flask responds with a ``503 Service Unavailable`` error, including a
+    ``Retry-After`` header.
+
+    """
+
+
+def _warm_up():
+    """Import WeasyPrint and initialize its fonts in a new worker process."""
+    from weasyprint import HTML
+
+    HTML(string='<p>Flask-WeasyPrint</p>').render()
+
+
+def _render(html, string, base_url, stylesheets, resources, options):
+    """Render a document captured by :meth:`PdfRenderer.submit` to PDF."""
+    from weasyprint import CSS, HTML
+    from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+    def resource_digest(url):
+        if url in resources:
+            return sha256(resources[url][1]).hexdigest()
+
+    class SnapshotFetcher(URLFetcher):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.fetched = {}
+
+        def fetch(self, url, headers=None):
+            self.fetched[url] = resource_digest(url)
+            if url in resources:
+                return URLFetcherResponse(*resources[url])
+            return super().fetch(url, headers)
+
+    def parse(url):
+        # Stylesheets only using captured resources are reused while unchanged.
+        if entry := _worker_stylesheets.get(url):
+            dependencies, css = entry
+            if all(
+                    digest is not None and digest == resource_digest(url)
+                    for url, digest in dependencies.items()):
+                return css
+        url_fetcher = SnapshotFetcher()
+        css = CSS(url=url, url_fetcher=url_fetcher)
+        _worker_stylesheets.set(url, url_fetcher.fetched, css)
+        return css
+
+    stylesheets = [parse(url) for url in stylesheets]
+    url_fetcher = SnapshotFetcher()
+    html = HTML(html, string=string, base_url=base_url, url_fetcher=url_fetcher)
+    return html.write_pdf(stylesheets=stylesheets, **options)
+
+
+class PdfRenderer:
+    """Render PDF documents in a pool of worker processes.
+
+    Documents are fetched in the request process, with all their resources
+    served by the app, and sent to workers that don’t need any Flask context.
+    Other resources are fetched by the workers.
+
+    :param int max_workers:
+        The maximum number of documents rendered at the same time, defaults
+        to the number of processors.
+    :param int max_queue:
+        The maximum number of documents waiting for a worker, unlimited by
+        default.
+    :param float queue_timeout:
+        The number of seconds to wait for a place in the queue before raising
+        :class:`RendererBusyError`, wait forever by default.
+    :param int retry_after:
+        The number of seconds given in the ``Retry-After`` header of
+        responses when the queue is full.
+    :param mp_context:
+        The :mod:`multiprocessing` context used to start workers, or the name
+        of its start method. Workers are spawned by default, as forking
+        multi-threaded servers is unsafe.
+
+    Workers are started on first use, and import WeasyPrint before rendering
+    their first document.
+
+    """
+    def __init__(self, max_workers=None, max_queue=None, queue_timeout=None,
+                 mp_context=None, retry_after=DEFAULT_RETRY_AFTER):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_timeout = queue_timeout
+        if mp_context is None or isinstance(mp_context, str):
+            mp_context = multiprocessing.get_context(mp_context or 'spawn')
+        self.mp_context = mp_context
+        self.retry_after = retry_after
+        self._slots = None
+        if max_queue is not None:
+            self._slots = BoundedSemaphore(self.max_workers + max_queue)
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def executor(self):
+        """The :class:`concurrent.futures.ProcessPoolExecutor` of workers."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers, mp_context=self.mp_context,
+                    initializer=_warm_up)
+            return self._executor
+
+    def submit(self, html=None, stylesheets=None, *, string=None,
+               url_fetcher=None, **options):
+        """Render a document and return a future of the PDF bytes.
+
+        ``html`` is a URL and ``stylesheets`` a list of URLs, relative to the
+        current request. ``string`` can be given instead of ``html``, with
+        the request’s URL as base URL. ``url_fetcher``, returned by
+        :func:`flask_weasyprint.make_url_fetcher` by default, is used to
+        capture the resources. ``options`` are given to
+        :meth:`weasyprint.HTML.write_pdf`.
+
+        This requires a Flask :doc:`request context <flask:reqcontext>`.
+
+        """
+        from weasyprint import HTML  # lazy loading
+
+        from . import _html_subresources, make_url_fetcher
+
+        if self._slots and not self._slots.acquire(timeout=self.queue_timeout):
+            raise RendererBusyError(
+                'Too many documents waiting to be rendered',
+                retry_after=self.retry_after)
+        try:
+            url_fetcher = url_fetcher or make_url_fetcher()
+            base_url = None if string is None else request.url
+            if html is not None:
+                html = urljoin(request.url, html)
+                url_fetcher.prefetch([html], external=False)
+            stylesheets = [
+                urljoin(request.url, url) for url in stylesheets or ()]
+            document = HTML(
+                html, string=string, base_url=base_url, url_fetcher=url_fetcher)
+            url_fetcher.prefetch(
+                {*stylesheets, *_html_subresources(document)}, external=False)
+            future = self.executor.submit(
+                _render, html, string, base_url, stylesheets,
+                url_fetcher.prefetched, options)
+        except BaseException:
+            if self._slots:
+                self._slots.release()
+            raise
+        if self._slots:
+            future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        """Stop the workers, see :meth:`Executor.shutdown`."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def get_pdf_renderer(app):
+    """Return the :class:`PdfRenderer` registered for ``app``.
+
+    The renderer is created on first use, configured by the
+    ``WEASYPRINT_WORKERS``, ``WEASYPRINT_MAX_QUEUE``,
+    ``WEASYPRINT_QUEUE_TIMEOUT`` and ``WEASYPRINT_MP_CONTEXT`` configuration
+    values.
+
+    """
+    if 'weasyprint_renderer' not in app.extensions:
+        app.extensions['weasyprint_renderer'] = PdfRenderer(
+            max_workers=app.config.get('WEASYPRINT_WORKERS'),
+            max_queue=app.config.get('WEASYPRINT_MAX_QUEUE'),
+            queue_timeout=app.config.get('WEASYPRINT_QUEUE_TIMEOUT'),
+            mp_context=app.config.get('WEASYPRINT_MP_CONTEXT'))
+    return app.extensions['weasyprint_renderer']
+
+
+class BatchRenderer:
+    """Render many PDF documents sharing the same resources.
+
+    Documents are rendered by ``renderer``, a :class:`PdfRenderer` (by
+    default the one returned by :func:`get_pdf_renderer`). The responses of
+    the app are cached for the whole batch, with at most ``cache_size``
+    responses, and workers reuse the stylesheets they have already parsed.
+
+    If ``template`` is given, documents are rendered from this template,
+    otherwise documents are URLs. ``stylesheets`` is a list of URLs, and
+    ``options`` are given to :meth:`weasyprint.HTML.write_pdf`.
+
+    At most ``max_pending`` documents are rendered or kept in memory at the
+    same time, twice the number of workers by default.
+
+    """
+    def __init__(self, template=None, stylesheets=None, renderer=None,
+                 max_pending=None, cache_size=DEFAULT_BATCH_CACHE_SIZE,
+                 **options):
+        self.template = template
+        self.stylesheets = stylesheets
+        self.renderer = renderer
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.options = options
+
+    def render(self, items, return_exceptions=False):
+        """Render documents and yield ``(item, pdf)`` tuples as completed.
+
+        ``items`` are URLs, or template contexts if the batch has a template.
+        If ``return_exceptions`` is :obj:`True`, exceptions raised while
+        rendering a document are yielded instead of its PDF, and the
+        following documents are rendered.
+
+        This requires a Flask :doc:`application context <flask:appcontext>`.
+        Without a request context, URLs are relative to the root URL given by
+        the ``SERVER_NAME``, ``APPLICATION_ROOT`` and ``PREFERRED_URL_SCHEME``
+        :doc:`configuration <flask:config>` values.
+
+        """
+        from . import make_url_fetcher
+
+        app = current_app._get_current_object()
+        renderer = self.renderer or get_pdf_renderer(app)
+        max_pending = self.max_pending or 2 * renderer.max_workers
+
+        def context():
+            if has_request_context():
+                return nullcontext()
+            return app.test_request_context()
+
+        def completed():
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                if return_exceptions and future.exception() is not None:
+                    yield item, future.exception()
+                else:
+                    yield item, future.result()
+
+        with context():
+            shared_fetcher = make_url_fetcher(cache_size=self.cache_size)
+
+        pending = {}
+        try:
+            for item in items:
+                if len(pending) >= max_pending:
+                    yield from completed()
+                try:
+                    with context():
+                        future = self._submit(renderer, shared_fetcher, item)
+                except Exception as exception:
+                    if not return_exceptions:
+                        raise
+                    yield item, exception
+                else:
+                    pending[future] = item
+            while pending:
+                yield from completed()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _submit(self, renderer, shared_fetcher, item):
+        # Copies of a fetcher share its cache of responses.
+        url_fetcher = shared_fetcher.copy()
+        if self.template is None:
+            return renderer.submit(
+                item, self.stylesheets, url_fetcher=url_fetcher, **self.options)
+        return renderer.submit(
+            stylesheets=self.stylesheets,
+            string=render_template(self.template, **item),
+            url_fetcher=url_fetcher, **self.options)
+
+
+def render_many(items, template=None, stylesheets=None, renderer=None,
+                **options):
+    """Render many PDF documents, yield ``(item, pdf)`` tuples as completed.
+
+    This is a shortcut for :meth:`BatchRenderer.render`.
+
+    """
+    batch = BatchRenderer(template, stylesheets, renderer, **options)
+    yield from batch.render(items)
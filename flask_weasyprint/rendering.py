@@ -0,0 +1,75 @@
+"""Helpers shared by the renderers of documents and static fragments."""
+
+from hashlib import sha256
+from urllib.parse import urljoin
+from weakref import WeakKeyDictionary
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Fingerprints of stylesheets created by CSS(), used by render_pdf caches.
+_STYLESHEET_FINGERPRINTS = WeakKeyDictionary()
+
+
+def _arguments(args, kwargs, url):
+    """Return ``(guess, args, kwargs)`` with URLs relative to url."""
+    if args:
+        guess, args = args[0], args[1:]
+    else:
+        guess = kwargs.pop('guess', None)
+    if guess is not None and not hasattr(guess, 'read'):
+        # Assume a (possibly relative) URL
+        guess = urljoin(url, guess)
+    if 'string' in kwargs and 'base_url' not in kwargs:
+        # Strings do not have an "intrinsic" base URL, use the request context.
+        kwargs['base_url'] = url
+    return guess, args, kwargs
+
+
+def _fingerprint(html, stylesheets, options):
+    """Return a fingerprint of the rendering of html, or None if unknown."""
+    from xml.etree.ElementTree import tostring  # lazy loading
+
+    if getattr(html.url_fetcher, 'fetched', False) is False:
+        return  # Fetched resources can’t be recorded
+    hasher = sha256(tostring(html.etree_element))
+    for stylesheet in stylesheets or ():
+        if isinstance(stylesheet, str):
+            hasher.update(stylesheet.encode())
+        elif stylesheet in _STYLESHEET_FINGERPRINTS:
+            hasher.update(_STYLESHEET_FINGERPRINTS[stylesheet].encode())
+        else:
+            return  # Unknown stylesheet source
+    options = repr((html.base_url, html.media_type, sorted(options.items())))
+    if ' at 0x' in options:
+        return  # Options include objects with no meaningful representation
+    hasher.update(options.encode())
+    return hasher.hexdigest()
+
+
+def _dependencies_match(url_fetcher, dependencies):
+    """Return whether resources fetched from URLs have the given digests."""
+    for url, digest in dependencies.items():
+        hasher = sha256()
+        try:
+            response = url_fetcher(url)
+            try:
+                while chunk := response.read(READ_CHUNK_SIZE):
+                    hasher.update(chunk)
+            finally:
+                response.close()
+        except Exception:
+            return False
+        if hasher.hexdigest() != digest:
+            return False
+    return True
+
+
+def _layout(html, stylesheets, options):
+    """Return the laid out :class:`weasyprint.Document` of html."""
+    from weasyprint import DEFAULT_OPTIONS  # lazy loading
+
+    options = {**DEFAULT_OPTIONS, **options, 'stylesheets': stylesheets}
+    options.pop('zoom', None), options.pop('finisher', None)
+    return html.render(
+        options.pop('font_config', None), options.pop('counter_style', None),
+        options.pop('color_profiles', None), **options)
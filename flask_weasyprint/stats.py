@@ -0,0 +1,80 @@
+"""Signals and statistics about PDF rendering."""
+
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+#: Sent by URL fetchers for each fetched resource, with the fetcher as sender
+#: and a :class:`FetchRecord` as ``record``.
+resource_fetched = _signals.signal('resource-fetched')
+
+#: Sent by :func:`flask_weasyprint.render_pdf` for each PDF, with the app as
+#: sender, a :class:`RenderStats` as ``stats`` and the PDF ``response``.
+pdf_rendered = _signals.signal('pdf-rendered')
+
+#: Sent by :class:`flask_weasyprint.RenderProfiler` for each profiled PDF, with
+#: the app as sender and a :class:`flask_weasyprint.RenderProfile` as
+#: ``profile``.
+pdf_profiled = _signals.signal('pdf-profiled')
+
+# Statistics of the PDF being rendered, given to fetchers created meanwhile.
+current_stats = ContextVar('flask_weasyprint_stats', default=None)
+
+
+class FetchRecord(NamedTuple):
+    """Information about a fetched resource."""
+
+    #: The fetched URL.
+    url: str
+    #: Whether the URL has been dispatched to the application.
+    dispatched: bool
+    #: The HTTP status, :obj:`None` if the resource couldn’t be fetched.
+    status: int | None
+    #: The size of the response body in bytes.
+    size: int
+    #: The fetching duration in seconds.
+    duration: float
+
+
+class RenderStats:
+    """Durations of the rendering phases of a PDF, in seconds.
+
+    ``html_time`` is the time spent creating the HTML object, ``layout_time``
+    the time spent laying out the document and ``pdf_time`` the time spent
+    serializing the PDF. ``fetches`` is the list of :class:`FetchRecord` for
+    resources fetched meanwhile, during HTML creation and layout.
+
+    """
+    def __init__(self):
+        self.html_time = self.layout_time = self.pdf_time = 0
+        self.fetches = []
+        #: The size of the PDF in bytes.
+        self.pdf_size = None
+        #: Whether the PDF has been found in the PDF cache.
+        self.cached = False
+
+    def __repr__(self):
+        return (
+            f'<{type(self).__name__} total={self.total_time:.3f}s '
+            f'fetches={len(self.fetches)}>')
+
+    @property
+    def fetch_time(self):
+        """The cumulated time spent fetching resources."""
+        return sum(record.duration for record in self.fetches)
+
+    @property
+    def total_time(self):
+        """The time spent rendering the PDF."""
+        return self.html_time + self.layout_time + self.pdf_time
+
+    def server_timing(self):
+        """Return the value of a ``Server-Timing`` HTTP header."""
+        metrics = (
+            ('html', self.html_time), ('fetch', self.fetch_time),
+            ('layout', self.layout_time), ('pdf', self.pdf_time))
+        return ', '.join(
+            f'{name};dur={duration * 1000:.1f}' for name, duration in metrics)
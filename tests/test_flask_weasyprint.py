@@ -1,13 +1,60 @@
 """Tests for Flask-WeasyPrint."""
 
+import asyncio
+import pickle
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Thread
 from urllib.error import HTTPError
 
 import pytest
-from flask import Flask, json, jsonify, redirect, request
+from flask import Blueprint, Flask, json, jsonify, redirect, request, send_file
+from PIL import Image
 from weasyprint import __version__ as weasyprint_version
 from weasyprint.urls import URLFetcher, URLFetcherResponse
+from werkzeug.exceptions import NotFound
 
-from flask_weasyprint import CSS, HTML, make_url_fetcher, render_pdf
+from flask_weasyprint import (
+    CSS,
+    HTML,
+    AssetCache,
+    BatchRenderer,
+    DocumentCache,
+    FileSystemPdfCache,
+    FlaskWeasyPrint,
+    ForwardingPolicy,
+    ImageDownscaler,
+    MemoryPdfCache,
+    PdfRenderer,
+    RenderContext,
+    RendererBusyError,
+    RenderLimiter,
+    RenderLimitError,
+    RenderProfiler,
+    RenderStats,
+    ResourceTooLargeError,
+    StaticFragment,
+    estimate_cost,
+    fragment_cache,
+    get_asset_cache,
+    get_extension,
+    make_flask_url_dispatcher,
+    make_url_fetcher,
+    pdf_profiled,
+    pdf_rendered,
+    preload,
+    public_view,
+    render_many,
+    render_pdf,
+    render_pdf_async,
+    render_preview,
+    resource_fetched,
+    stylesheet_cache,
+)
+from flask_weasyprint.cli import cli
+from flask_weasyprint.dispatcher import MAX_DISPATCHERS
+from flask_weasyprint.pool import ConnectionPool, PooledURLFetcher
 
 from . import app, document_html
 
@@ -42,6 +89,258 @@ def test_url_fetcher():
     assert response.content_type == 'image/svg+xml'
 
 
+def test_url_fetcher_cache():
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/style.css')
+    def style():
+        calls.append(request.cookies.get('cookie'))
+        return 'a { color: red }', 200, {'Content-Type': 'text/css'}
+
+    with app.test_request_context():
+        fetcher = make_url_fetcher()
+    for _ in range(3):
+        assert fetcher('http://localhost/style.css').read() == b'a { color: red }'
+    assert calls == [None]
+
+    # Cookies are part of the cache key.
+    with app.test_request_context(headers={'Cookie': 'cookie=value'}):
+        fetcher = make_url_fetcher()
+    assert fetcher('http://localhost/style.css').read() == b'a { color: red }'
+    assert fetcher('http://localhost/style.css').read() == b'a { color: red }'
+    assert calls == [None, 'value']
+
+    # The cache can be disabled.
+    with app.test_request_context():
+        fetcher = make_url_fetcher(cache_size=0)
+    fetcher('http://localhost/style.css')
+    fetcher('http://localhost/style.css')
+    assert calls == [None, 'value', None, None]
+
+
+def test_shared_cache():
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/<name>')
+    def asset(name):
+        calls.append(name)
+        response = app.make_response(name)
+        if name == 'validated':
+            response.set_etag(name)
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        elif name == 'fresh':
+            response.cache_control.max_age = 3600
+        elif name == 'no-store':
+            response.cache_control.no_store = True
+            response.cache_control.max_age = 3600
+        return response
+
+    asset_cache = get_asset_cache(app)
+    assert isinstance(asset_cache, AssetCache)
+    assert get_asset_cache(app) is asset_cache
+    for _ in range(3):
+        with app.test_request_context():
+            fetcher = make_url_fetcher(shared_cache=True)
+        for name in ('validated', 'fresh', 'no-store', 'uncacheable'):
+            assert fetcher(f'http://localhost/{name}').read() == name.encode()
+    assert calls.count('fresh') == 1
+    assert calls.count('validated') == 3
+    assert calls.count('no-store') == 3
+    assert calls.count('uncacheable') == 3
+    assert asset_cache.revalidations == 2
+    assert asset_cache.hits == 4
+    assert asset_cache.misses == 8
+
+    # A cache can also be given explicitly.
+    asset_cache = AssetCache(max_size=1)
+    with app.test_request_context():
+        fetcher = make_url_fetcher(cache_size=0, shared_cache=asset_cache)
+    fetcher('http://localhost/fresh')
+    fetcher('http://localhost/fresh')
+    assert (asset_cache.hits, asset_cache.misses, len(asset_cache)) == (1, 1, 1)
+
+
+def test_forwarding_policy():
+    app = Flask(__name__)
+    charts = Blueprint('charts', __name__)
+    calls = []
+
+    @app.route('/style.css')
+    @app.route('/account.css', endpoint='account')
+    @charts.route('/chart.svg')
+    def echo():
+        calls.append(request.path)
+        response = app.make_response(
+            f'{request.headers.get("Cookie")} {request.headers.get("X-Lang")}')
+        response.cache_control.max_age = 3600
+        return response
+
+    @app.route('/logo.svg')
+    @public_view
+    def logo():
+        return echo()
+
+    app.register_blueprint(charts, url_prefix='/charts')
+    policy = ForwardingPolicy(
+        cookies=('lang',), headers=('X-Lang',),
+        rules={'account': ForwardingPolicy(cookies=('lang', 'session'))},
+        public=('charts',))
+    cookie, headers = 'session=secret; lang=fr', (('X-Lang', 'fr'), ('X-A', 'a'))
+
+    def fetch(url, cookie=cookie):
+        context = RenderContext('http://localhost/', '', cookie, headers)
+        with app.test_request_context():
+            fetcher = make_url_fetcher(
+                context=context, forwarding=policy, shared_cache=True)
+        return fetcher(f'http://localhost/{url}').read().decode()
+
+    # Only allowed cookies and headers are given to the app.
+    assert fetch('style.css') == 'lang=fr fr'
+    assert fetch('account.css') == 'session=secret; lang=fr fr'
+    assert fetch('charts/chart.svg') == 'None None'
+    assert fetch('logo.svg') == 'None None'
+
+    # Responses of public endpoints are shared between users.
+    assert fetch('charts/chart.svg', cookie='session=other') == 'None None'
+    assert fetch('account.css', cookie='session=other') == 'session=other fr'
+    assert calls.count('/charts/chart.svg') == 1
+    assert calls.count('/account.css') == 2
+
+
+def test_static_files(tmp_path):
+    (tmp_path / 'static').mkdir()
+    (tmp_path / 'static' / 'style.css').write_text('a { color: red }')
+    (tmp_path / 'static' / 'font.woff').write_bytes(b'\0' * 2 * 1024 * 1024)
+    (tmp_path / 'blueprint').mkdir()
+    (tmp_path / 'blueprint' / 'image.svg').write_text('<svg></svg>')
+    (tmp_path / 'secret').write_text('secret')
+
+    app = Flask(__name__, root_path=tmp_path)
+    blueprint = Blueprint(
+        'blueprint', __name__, root_path=tmp_path, static_folder='blueprint',
+        static_url_path='/static')
+    app.register_blueprint(blueprint, url_prefix='/blueprint')
+    requests = []
+    app.before_request(lambda: requests.append(request.path))
+
+    with app.test_request_context():
+        fetcher = make_url_fetcher()
+    response = fetcher('http://localhost/static/style.css')
+    assert response.read() == b'a { color: red }'
+    assert response.content_type == 'text/css'
+    assert response.charset == 'utf-8'
+    response = fetcher('http://localhost/static/font.woff')
+    assert response.read() == b'\0' * 2 * 1024 * 1024
+    response.close()
+    response = fetcher('http://localhost/blueprint/static/image.svg')
+    assert response.read() == b'<svg></svg>'
+    assert response.content_type == 'image/svg+xml'
+    assert requests == []
+
+    # Unsafe and missing files are requested to the app.
+    for path in ('/static/..%2Fsecret', '/static/missing.css'):
+        with pytest.raises(HTTPError, match='404'):
+            fetcher(f'http://localhost{path}')
+    assert requests == ['/static/../secret', '/static/missing.css']
+
+    # The fast path can be disabled.
+    with app.test_request_context():
+        fetcher = make_url_fetcher(static_files=False)
+    assert fetcher('http://localhost/static/style.css').read() == b'a { color: red }'
+    assert requests[-1] == '/static/style.css'
+
+
+def test_prefetch():
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/<name>')
+    def resource(name):
+        calls.append(name)
+        if name == 'style.css':
+            css = '@import "print.css"; body { background: url(bg.svg) }'
+            return css, 200, {'Content-Type': 'text/css'}
+        elif name == 'print.css':
+            css = '@font-face { src: url("font.woff") }'
+            return css, 200, {'Content-Type': 'text/css'}
+        return name
+
+    html_string = '''
+        <link rel=stylesheet href=style.css><link rel=icon href=icon.png>
+        <style>@import url(inline.css)</style>
+        <img src=image.svg#fragment><p style="background: url('bg.png')">
+        <img src="data:image/svg+xml,<svg></svg>"><a href=link.html>
+    '''
+    with app.test_request_context():
+        html = HTML(string=html_string, prefetch=2)
+    assert sorted(calls) == sorted([
+        'style.css', 'print.css', 'bg.svg', 'font.woff', 'inline.css',
+        'image.svg', 'bg.png'])
+
+    # Prefetched responses are kept in memory.
+    calls.clear()
+    fetcher = html.url_fetcher
+    assert fetcher('http://localhost/bg.svg').read() == b'bg.svg'
+    assert fetcher('http://localhost/style.css').content_type == 'text/css'
+    assert calls == []
+
+    # Errors are ignored while prefetching.
+    fetcher.prefetch(['http://localhost/missing/', 'http://localhost/bg.png'])
+    with pytest.raises(HTTPError, match='404'):
+        fetcher('http://localhost/missing/')
+
+
+def test_stylesheet_cache():
+    app = Flask(__name__)
+    style = {'color': 'red'}
+    calls = []
+
+    @app.route('/<name>.css')
+    def stylesheet(name):
+        calls.append(name)
+        css = f'p {{ color: {style["color"]} }}'
+        if name == 'import':
+            css = f'@import "style.css"; {css}'
+        return css, 200, {'Content-Type': 'text/css'}
+
+    @app.route('/validated.css')
+    def validated():
+        response = app.make_response('p { color: red }')
+        response.set_etag('red')
+        response.cache_control.no_cache = True
+        response = response.make_conditional(request)
+        calls.append(response.status_code)
+        return response
+
+    stylesheet_cache.clear()
+    with app.test_request_context('/'):
+        css = CSS('/style.css')
+        assert CSS('/style.css') is css
+        assert CSS('/style.css', cache=False) is not css
+        imported_css = CSS('/import.css')
+        assert CSS(url='http://localhost/import.css') is not imported_css
+        assert CSS('import.css') is imported_css
+    with app.test_request_context('/other/'):
+        assert CSS('http://localhost/style.css') is css
+        assert CSS('../import.css') is imported_css
+    assert len(stylesheet_cache) == 3
+
+    # Stylesheets are parsed again when resources change.
+    style['color'] = 'blue'
+    with app.test_request_context('/'):
+        assert CSS('/style.css') is not css
+        assert CSS('/import.css') is not imported_css
+
+    # Resources are checked with conditional requests.
+    with app.test_request_context('/'):
+        css = CSS('/validated.css')
+        assert CSS('/validated.css') is css
+    assert calls[-2:] == [200, 304]
+
+
 def test_wrappers():
     with app.test_request_context(base_url='http://example.org/bar/'):
         # HTML can also be used with named parameters only:
@@ -49,6 +348,14 @@ def test_wrappers():
         css = CSS(url='http://example.org/bar/static/style.css')
     assert html.write_pdf(stylesheets=[css]).startswith(b'%PDF')
 
+    # Given URL fetchers are used instead of the default ones.
+    with app.test_request_context(base_url='http://example.org/bar/'):
+        url_fetcher = make_url_fetcher()
+        html = HTML(url='http://example.org/bar/foo/', url_fetcher=url_fetcher)
+        assert html.url_fetcher is url_fetcher
+        css = CSS(string='p { color: red }', url_fetcher=URLFetcher())
+    assert html.write_pdf(stylesheets=[css]).startswith(b'%PDF')
+
 
 @pytest.mark.parametrize(('url', 'filename', 'automatic', 'cookie'), [
     ('/foo.pdf', None, None, None),
@@ -87,6 +394,386 @@ def test_pdf(url, filename, automatic, cookie):
         assert disposition is None
 
 
+@pytest.mark.parametrize('stream', [True, False])
+def test_pdf_range(stream):
+    with app.test_request_context('/foo/'):
+        pdf = render_pdf(HTML(string=document_html()), stream=stream)
+        pdf.direct_passthrough = False
+        pdf = pdf.get_data()
+    with app.test_request_context('/foo/', headers={'Range': 'bytes=0-9'}):
+        response = render_pdf(HTML(string=document_html()), stream=stream)
+        response.direct_passthrough = False
+        assert response.status_code == 206
+        assert response.content_length == 10
+        assert response.headers['Content-Range'] == f'bytes 0-9/{len(pdf)}'
+        assert response.get_data() == pdf[:10]
+
+
+@pytest.mark.parametrize('cache_class', [MemoryPdfCache, FileSystemPdfCache])
+def test_pdf_cache(cache_class, tmp_path):
+    cache = cache_class() if cache_class is MemoryPdfCache else cache_class(tmp_path)
+    app = Flask(__name__)
+    style = {'color': 'red'}
+
+    @app.route('/style.css')
+    def stylesheet():
+        return f'p {{ color: {style["color"]} }}', 200, {'Content-Type': 'text/css'}
+
+    renders = []
+
+    def get_response(headers=None):
+        with app.test_request_context('/', headers=headers):
+            html = HTML(string='<link rel=stylesheet href=style.css><p>a</p>')
+            with pdf_rendered.connected_to(
+                    lambda app, stats, response: stats.cached or renders.append(1),
+                    app):
+                response = render_pdf(html, pdf_cache=cache)
+            response.direct_passthrough = False
+        return response
+
+    response = get_response()
+    etag, _ = response.get_etag()
+    pdf = response.get_data()
+    assert etag
+    assert len(renders) == 1
+
+    # The cached PDF is used when nothing changes.
+    response = get_response()
+    assert response.get_etag() == (etag, False)
+    assert response.get_data() == pdf
+    assert len(renders) == 1
+    assert get_response({'If-None-Match': f'"{etag}"'}).status_code == 304
+    assert len(renders) == 1
+
+    # Changed resources invalidate the cached PDF.
+    style['color'] = 'blue'
+    response = get_response({'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+    assert len(renders) == 2
+
+
+def test_document_cache():
+    app = Flask(__name__)
+    cache = DocumentCache()
+    layouts = []
+
+    def render(function, **options):
+        with app.test_request_context('/'):
+            html = HTML(string='<p style="break-after: page">a</p><p>b</p>')
+            with pdf_rendered.connected_to(
+                    lambda app, stats, response: layouts.append(stats.layout_time),
+                    app):
+                response = function(html, document_cache=cache, **options)
+            response.direct_passthrough = False
+        return len(re.findall(rb'/Type /Page\b', response.get_data()))
+
+    # Documents are laid out once, for all their pages and page ranges.
+    assert render(render_pdf, uncompressed_pdf=True) == 2
+    assert render(render_preview, uncompressed_pdf=True) == 1
+    assert render(render_pdf, pages=[1, 0], uncompressed_pdf=True) == 2
+    assert layouts[0] > 0
+    assert layouts[1:] == [0, 0]
+    # Pages out of the document are not found.
+    for pages in ([2], [-1]):
+        with pytest.raises(NotFound):
+            render(render_pdf, pages=pages)
+
+    # Documents expire.
+    cache = DocumentCache(ttl=0)
+    cache.set('key', {}, 'document')
+    assert cache.get('key') is None
+    assert len(cache) == 0
+
+
+def test_static_fragments():
+    app = Flask(__name__)
+    cover = StaticFragment(string='<h1>Cover</h1>')
+    terms = StaticFragment(
+        string='<p style="break-after: page">a</p><p>b</p>',
+        stylesheets=('/terms.css',))
+
+    @app.route('/terms.css')
+    def terms_stylesheet():
+        return 'p { color: red }', 200, {'Content-Type': 'text/css'}
+
+    def render():
+        with app.test_request_context('/'):
+            html = HTML(string='<p>Report</p>')
+            response = render_pdf(
+                html, before=[cover], after=[terms], uncompressed_pdf=True)
+            response.direct_passthrough = False
+        return len(re.findall(rb'/Type /Page\b', response.get_data()))
+
+    # Fragments are laid out once, their pages are added around the document.
+    fragment_cache.clear()
+    assert render() == 4
+    assert len(fragment_cache) == 2
+    assert render() == 4
+    assert len(fragment_cache) == 2
+
+
+def test_render_limiter():
+    from weasyprint.logger import PROGRESS_LOGGER
+
+    app = Flask(__name__)
+    limiter = RenderLimiter(1, max_waiting=0, retry_after=10)
+
+    @app.route('/report.pdf')
+    def report():
+        return render_pdf(HTML(string='<p>a</p>'), limiter=limiter)
+
+    # Renders are refused when no slot is available.
+    client = app.test_client()
+    with limiter.limit(None):
+        assert limiter.used == 1
+        response = client.get('/report.pdf')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '10'
+        limiter.max_waiting, limiter.timeout = None, 0.01
+        assert client.get('/report.pdf').status_code == 503
+        assert limiter.waiting == 0
+    assert limiter.used == 0
+    assert client.get('/report.pdf').status_code == 200
+
+    # Renders are stopped when they exceed their budget.
+    level = PROGRESS_LOGGER.level
+    limiter = RenderLimiter(max_pages=2, max_duration=60)
+    with limiter.limit(None):
+        PROGRESS_LOGGER.info('Step 5 - Creating layout - Page %d', 2)
+        with pytest.raises(RenderLimitError, match='2 pages'):
+            PROGRESS_LOGGER.info('Step 5 - Creating layout - Page %d', 3)
+    PROGRESS_LOGGER.info('Step 5 - Creating layout - Page %d', 3)
+
+    # The level of the progress logger is set back after renders.
+    assert client.get('/report.pdf').status_code == 200
+    assert PROGRESS_LOGGER.level == level
+    assert not PROGRESS_LOGGER.filters
+
+    # Costs depend on the size of documents.
+    with app.test_request_context():
+        assert estimate_cost(HTML(string='<p>a</p>')) == 1
+        assert estimate_cost(HTML(string='<p>a</p>' * 10000)) == 3
+
+
+def test_render_profiler(tmp_path):
+    app = Flask(__name__)
+
+    @app.route('/style.css')
+    def stylesheet():
+        return 'p { color: red }', 200, {'Content-Type': 'text/css'}
+
+    profiles = []
+    profiler = RenderProfiler(tmp_path, cpu=True)
+    with (
+            app.test_request_context('/'),
+            pdf_profiled.connected_to(
+                lambda app, profile: profiles.append(profile), app)):
+        html = '<link rel=stylesheet href=style.css><p>a</p>'
+        response = render_pdf(HTML(string=html), profiler=profiler)
+        response.direct_passthrough = False
+        HTML(string=html, profiler=profiler)
+        profiler.rate = 0
+        render_pdf(HTML(string=html), profiler=profiler)
+
+    # Profiles are sent and written for sampled documents.
+    assert len(profiles) == 2
+    profile = profiles[0]
+    assert profile.url == 'http://localhost/'
+    assert profile.peak_memory > 0
+    assert profile.stats.pdf_size == len(response.get_data())
+    assert profile.cpu is not None
+    report = json.loads((tmp_path / f'{profile.id}.json').read_text())
+    assert report['pdf_size'] == profile.stats.pdf_size
+    assert report['fetches'][0]['url'] == 'http://localhost/style.css'
+    assert report['fetches'][0]['size'] == 16
+    assert all(site['size'] > 0 for site in report['allocations'])
+    assert (tmp_path / f'{profile.id}.pstats').exists()
+    assert profiles[1].stats.pdf_size is None
+    assert len(list(tmp_path.glob('*.json'))) == 2
+
+
+def test_render_stats():
+    app = Flask(__name__)
+
+    @app.route('/style.css')
+    def stylesheet():
+        return 'p { color: red }', 200, {'Content-Type': 'text/css'}
+
+    records, rendered = [], []
+    with (
+            app.test_request_context('/'),
+            resource_fetched.connected_to(
+                lambda fetcher, record: records.append(record)),
+            pdf_rendered.connected_to(
+                lambda app, **kwargs: rendered.append(kwargs), app)):
+        stats = RenderStats()
+        html = HTML(string='<link rel=stylesheet href=style.css>')
+        response = render_pdf(html, stats=stats, server_timing=True)
+        response.direct_passthrough = False
+        with pytest.raises(HTTPError):
+            make_url_fetcher()('http://localhost/missing.css')
+
+    assert stats.fetches == records[:1]
+    assert stats.fetches[0][:4] == ('http://localhost/style.css', True, 200, 16)
+    assert records[1][:4] == ('http://localhost/missing.css', True, 404, 0)
+    assert stats.fetch_time == stats.fetches[0].duration
+    assert stats.total_time >= stats.layout_time > 0
+    assert stats.pdf_size == len(response.get_data())
+    assert rendered == [{'stats': stats, 'response': response}]
+    timings = response.headers['Server-Timing'].split(', ')
+    assert [timing.split(';')[0] for timing in timings] == [
+        'html', 'fetch', 'layout', 'pdf']
+
+    # Prefetched resources are recorded once.
+    with app.test_request_context('/'):
+        fetcher = make_url_fetcher()
+    fetcher.stats = stats = RenderStats()
+    fetcher.prefetch(['http://localhost/style.css'])
+    response = fetcher('http://localhost/style.css')
+    assert response.read() == b'p { color: red }'
+    response.close()
+    assert [record.size for record in stats.fetches] == [16]
+
+
+def test_renderer():
+    options = {}
+    if int(weasyprint_version.split('.')[0]) >= 59:
+        options['uncompressed_pdf'] = True
+    renderer = PdfRenderer(max_workers=1, max_queue=0, queue_timeout=0)
+    try:
+        with app.test_request_context('/', headers={'Cookie': 'cookie=value'}):
+            future = renderer.submit('/foo/', **options)
+            with pytest.raises(RendererBusyError) as error:
+                renderer.submit('/foo/')
+            assert error.value.get_response().status_code == 503
+            assert error.value.get_response().headers['Retry-After'] == '5'
+        pdf = future.result()
+        assert pdf.startswith(b'%PDF')
+        assert b'value' in pdf
+
+        with app.test_request_context('/foo/'):
+            response = asyncio.run(render_pdf_async(
+                '/foo/', download_filename='foo.pdf', renderer=renderer,
+                **options))
+        assert response.mimetype == 'application/pdf'
+        assert b''.join(response.iter_encoded()).startswith(b'%PDF')
+        assert response.headers['Content-Disposition'] == (
+            'attachment; filename=foo.pdf')
+    finally:
+        renderer.shutdown()
+
+
+def test_batch_renderer():
+    options = {}
+    if int(weasyprint_version.split('.')[0]) >= 59:
+        options['uncompressed_pdf'] = True
+    renderer = PdfRenderer(max_workers=2)
+    try:
+        # URLs are relative to the configured root URL without request.
+        with app.app_context():
+            pdfs = dict(render_many(
+                ['/foo/', 'http://localhost/foo/'], stylesheets=['/static/style.css'],
+                renderer=renderer, **options))
+        assert set(pdfs) == {'/foo/', 'http://localhost/foo/'}
+        assert all(pdf.startswith(b'%PDF') for pdf in pdfs.values())
+
+        contexts = [
+            {'data': [1, 2], 'labels': ['a', 'b'], 'cookie': f'cookie{i}'}
+            for i in range(5)]
+        batch = BatchRenderer(
+            'document.html', renderer=renderer, max_pending=2, **options)
+        with app.test_request_context('/foo/'):
+            results = list(batch.render(contexts))
+        assert len(results) == len(contexts)
+        for context, pdf in results:
+            assert pdf.startswith(b'%PDF')
+            assert context['cookie'].encode() in pdf
+    finally:
+        renderer.shutdown()
+
+
+def test_cli(tmp_path):
+    runner = app.test_cli_runner()
+    urls = tmp_path / 'urls.txt'
+    urls.write_text('/foo/\n\n/missing\n')
+    output = tmp_path / 'output'
+
+    result = runner.invoke(cli, [
+        'render', '/foo/graph?data=1,2&labels=a,b', '--file', str(urls),
+        '--output', str(output), '--workers', '1', '--batch-size', '1'])
+    assert result.exit_code == 1
+    assert '2 PDF files rendered' in result.output
+    assert 'Failed to render /missing' in result.output
+    assert sorted(path.name for path in output.iterdir()) == [
+        'foo.pdf', 'foo_graphdata12labelsab.pdf']
+    assert (output / 'foo.pdf').read_bytes().startswith(b'%PDF')
+
+    (output / 'foo.pdf').write_bytes(b'old')
+    result = runner.invoke(cli, [
+        'render', '/foo/', '--output', str(output), '--resume'])
+    assert result.exit_code == 0
+    assert '0 PDF files rendered' in result.output
+    assert '1 skipped' in result.output
+    assert (output / 'foo.pdf').read_bytes() == b'old'
+
+    # URLs rendered to the same file are refused.
+    result = runner.invoke(cli, [
+        'render', '/foo', '/foo.pdf', '--output', str(output)])
+    assert result.exit_code == 2
+    assert '/foo and /foo.pdf are both rendered to foo.pdf' in result.output
+
+
+def test_pooled_url_fetcher():
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            connections.append(self.client_address)
+            super().setup()
+
+        def do_GET(self):
+            status = 404 if self.path == '/missing' else 200
+            body = b'*' * 100 if self.path == '/large' else self.path.encode()
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Fetcher(PooledURLFetcher):
+        pool = ConnectionPool(max_size=50, max_connections=2)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        # Connections are shared by fetchers.
+        assert Fetcher().fetch(f'{url}/a').read() == b'/a'
+        assert Fetcher().fetch(f'{url}/b').read() == b'/b'
+        assert len(connections) == 1
+        assert len(Fetcher.pool) == 1
+        with pytest.raises(HTTPError, match='404'):
+            Fetcher().fetch(f'{url}/missing')
+        with pytest.raises(ValueError, match='larger than 50'):
+            Fetcher().fetch(f'{url}/large')
+
+        # Pooled fetchers can be used for URLs not served by the app.
+        with app.test_request_context('/foo/'):
+            fetcher = make_url_fetcher(next_fetcher=Fetcher)
+        assert fetcher.fetch(f'{url}/c').read() == b'/c'
+        assert fetcher.fetch('http://localhost/static/style.css').read()
+        assert len(connections) == 2
+    finally:
+        Fetcher.pool.clear()
+        server.shutdown()
+        server.server_close()
+
+
 def test_redirects():
     app = Flask(__name__)
 
@@ -211,6 +898,297 @@ def test_dispatcher():
     assert_dummy('http://a.net/b/')
 
 
+def test_wsgi_request():
+    app = Flask(__name__)
+
+    @app.route('/<path:path>')
+    def echo(path):
+        response = jsonify(
+            path=path, args=request.args, cookie=request.headers.get('Cookie'),
+            root=request.script_root, url=request.url)
+        response.headers['X-Test'] = 'test'
+        return response
+
+    cookie = 'a=b; c="d e"'
+    headers = {'Cookie': cookie}
+    with app.test_request_context(base_url='http://a.net/b/', headers=headers):
+        fetcher = make_url_fetcher()
+    response = fetcher.fetch('http://a.net/b/c%20d/%C3%A9?e=f%20g')
+    assert response.headers['X-Test'] == 'test'
+    assert json.loads(response.read()) == {
+        'path': 'c d/é', 'args': {'e': 'f g'}, 'cookie': cookie, 'root': '/b',
+        'url': 'http://a.net/b/c%20d/é?e=f%20g'}
+
+
+def test_size_limits():
+    app = Flask(__name__)
+
+    @app.route('/<int:size>')
+    def data(size):
+        return (b'*' * 1000 for _ in range(size // 1000))
+
+    with app.test_request_context():
+        fetcher = make_url_fetcher(
+            max_size=5000, max_total_size=8000, spool_size=2000)
+    # Small responses are kept in memory.
+    assert fetcher.fetch('http://localhost/1000').read() == b'*' * 1000
+    # Large responses are written to temporary files and not cached.
+    response = fetcher.fetch('http://localhost/3000')
+    assert response.read(10) == b'*' * 10
+    assert len(response.read()) == 2990
+    response.close()
+    with pytest.raises(ResourceTooLargeError, match='5000 bytes'):
+        fetcher.fetch('http://localhost/6000')
+    with pytest.raises(ResourceTooLargeError, match='8000 bytes'):
+        fetcher.fetch('http://localhost/5000')
+    with pytest.raises(ResourceTooLargeError, match='8000 bytes'):
+        fetcher.fetch('http://localhost/2000')
+    # Cached responses don’t count in the total size.
+    for _ in range(10):
+        assert fetcher.fetch('http://localhost/1000').read() == b'*' * 1000
+
+    # Responses of the next fetcher are checked too.
+    class ExternalFetcher(URLFetcher):
+        def fetch(self, url, headers=None):
+            size = int(url.rsplit('/', 1)[1])
+            return URLFetcherResponse(url, BytesIO(b'*' * size))
+
+    with app.test_request_context():
+        fetcher = make_url_fetcher(
+            next_fetcher=ExternalFetcher, max_size=5000, max_total_size=8000)
+    assert fetcher.fetch('http://a.net/4000').read() == b'*' * 4000
+    with pytest.raises(ResourceTooLargeError, match='5000 bytes'):
+        fetcher.fetch('http://a.net/6000').read()
+    with pytest.raises(ResourceTooLargeError, match='8000 bytes'):
+        fetcher.fetch('http://a.net/5000').read()
+
+    # Digests are computed for large responses too.
+    with app.test_request_context():
+        fetcher = make_url_fetcher(spool_size=2000)
+    fetcher.fetched = {}
+    assert len(fetcher.fetch('http://localhost/3000').read()) == 3000
+    assert len(fetcher.fetched['http://localhost/3000']) == 64
+
+
+def test_image_downscaler():
+    app = Flask(__name__)
+    images = {}
+    for name, format in (('photo.jpg', 'JPEG'), ('small.jpg', 'JPEG'),
+                         ('chart.png', 'PNG')):
+        output = BytesIO()
+        size = (100, 50) if name == 'small.jpg' else (2000, 1000)
+        Image.effect_noise(size, 64).convert('RGB').save(output, format)
+        images[name] = output.getvalue()
+
+    @app.route('/<name>')
+    def image_file(name):
+        return send_file(BytesIO(images[name]), download_name=name)
+
+    downscaler = ImageDownscaler(dpi=192, max_width=200, max_height=200)
+    with app.test_request_context():
+        fetcher = make_url_fetcher(processors=[downscaler])
+    # Large images are downscaled, keeping their format and aspect ratio.
+    for name, format in (('photo.jpg', 'JPEG'), ('chart.png', 'PNG')):
+        response = fetcher.fetch(f'http://localhost/{name}')
+        data = response.read()
+        assert len(data) < len(images[name])
+        with Image.open(BytesIO(data)) as image:
+            assert (image.format, image.size) == (format, (400, 200))
+        assert 'Content-Length' not in response.headers
+    # Small images are unchanged.
+    assert fetcher.fetch('http://localhost/small.jpg').read() == images['small.jpg']
+    # Processed images are cached by digest.
+    assert len(downscaler) == 3
+    with app.test_request_context():
+        fetcher = make_url_fetcher(cache_size=0, processors=[downscaler])
+    fetcher.fetch('http://localhost/photo.jpg').read()
+    assert len(downscaler) == 3
+
+    # Processors can be chained, they get the same type of headers.
+    content_types = []
+
+    def processor(url, data, headers):
+        content_types.append(headers.get_content_type())
+
+    with app.test_request_context():
+        fetcher = make_url_fetcher(
+            cache_size=0, processors=[downscaler, processor])
+    response = fetcher.fetch('http://localhost/photo.jpg')
+    assert 'Content-Length' not in response.headers
+    assert content_types == ['image/jpeg']
+
+    # Images spooled to temporary files are processed too.
+    downscaler.clear()
+    with app.test_request_context():
+        fetcher = make_url_fetcher(
+            cache_size=0, processors=[downscaler], spool_size=1000)
+    with Image.open(fetcher.fetch('http://localhost/photo.jpg')) as image:
+        assert image.size == (400, 200)
+    response = fetcher.fetch('http://localhost/small.jpg')
+    assert response.read() == images['small.jpg']
+    response.close()
+
+
+def test_preload():
+    app = Flask(__name__)
+    app.config['SERVER_NAME'] = 'example.net'
+
+    @app.route('/style.css')
+    def stylesheet():
+        return 'p { color: red }', {'Content-Type': 'text/css'}
+
+    assert preload(render=False) == []
+    stylesheet_cache.clear()
+    css, = preload(['style.css'], app=app)
+    # Preloaded stylesheets are reused by requests.
+    with app.test_request_context():
+        assert CSS('/style.css') is css
+
+
+def test_extension():
+    app = Flask(__name__)
+    requests = []
+
+    @app.route('/<int:size>')
+    def data(size):
+        requests.append(size)
+        return b'*' * size
+
+    with app.app_context():
+        assert get_extension() is None
+    app.config['WEASYPRINT_MAX_SIZE'] = 1000
+    app.config['WEASYPRINT_MATCH_ROUTES'] = True
+    extension = FlaskWeasyPrint(app)
+    assert get_extension(app) is extension
+    assert app.config['WEASYPRINT_FETCHER_CACHE_SIZE'] == 256
+
+    with app.test_request_context():
+        fetcher = HTML(string='').url_fetcher
+        other_fetcher = HTML(string='').url_fetcher
+    # Fetcher classes are created once, copies share their caches.
+    assert type(fetcher) is type(other_fetcher)
+    assert fetcher.fetch('http://localhost/10').read() == b'*' * 10
+    assert fetcher.copy().fetch('http://localhost/10').read() == b'*' * 10
+    assert requests == [10]
+    # Fetchers are configured by the app.
+    with pytest.raises(ResourceTooLargeError):
+        fetcher.fetch('http://localhost/2000')
+    assert fetcher._dispatch('http://localhost/missing') is None
+
+    # Font configurations are not shared by default.
+    assert app.config['WEASYPRINT_SHARE_FONT_CONFIG'] is False
+    # When enabled, font configurations are shared by renders in the same thread.
+    font_configs = []
+    thread = Thread(target=lambda: font_configs.append(extension.font_config))
+    thread.start()
+    thread.join()
+    assert extension.font_config is extension.font_config
+    assert font_configs[0] is not extension.font_config
+
+
+def test_shared_font_config():
+    app = Flask(__name__)
+    extension = FlaskWeasyPrint(app)
+    documents = []
+
+    class RecordingCache(DocumentCache):
+        def set(self, key, dependencies, document):
+            documents.append(document)
+            super().set(key, dependencies, document)
+
+    def render_twice():
+        documents.clear()
+        for text in ('a', 'b'):
+            with app.test_request_context('/'):
+                render_pdf(
+                    HTML(string=f'<p>{text}</p>'), document_cache=RecordingCache())
+        return [document.font_config for document in documents]
+
+    # Each document has its own font configuration by default.
+    first, second = render_twice()
+    assert first is not second
+    assert extension.font_config not in (first, second)
+
+    # Documents rendered by the same thread share a font configuration.
+    app.config['WEASYPRINT_SHARE_FONT_CONFIG'] = True
+    first, second = render_twice()
+    assert first is second is extension.font_config
+
+
+def test_render_context():
+    app = Flask(__name__)
+
+    @app.route('/style.css')
+    def stylesheet():
+        color = request.cookies.get('color', 'red')
+        headers = {'Content-Type': 'text/css'}
+        return f'p {{ color: {color} }} /* {request.headers.get("X-Test")} */', headers
+
+    with app.test_request_context(
+            base_url='http://c.net/d/', headers={'Cookie': 'color=blue'}):
+        context = RenderContext.from_request()
+    assert context == ('http://c.net/d/', '/d', 'color=blue', ())
+    assert (context.scheme, context.host) == ('http', 'c.net')
+    context = pickle.loads(pickle.dumps(context._replace(headers=(('X-Test', 'e'),))))
+
+    # Only an app context is needed with a render context.
+    with app.app_context():
+        fetcher = make_url_fetcher(context=context)
+        assert fetcher('http://c.net/d/style.css').read() == (
+            b'p { color: blue } /* e */')
+        CSS('style.css', context=context)
+        html = HTML(string='<link rel=stylesheet href=style.css>', context=context)
+        assert html.base_url == 'http://c.net/d/'
+        response = render_pdf(html)
+        assert response.mimetype == 'application/pdf'
+
+        with pytest.raises(RuntimeError):
+            HTML(string='<p>')
+
+        app.config.update(SERVER_NAME='a.net', APPLICATION_ROOT='/b')
+        assert RenderContext.from_config('/f') == ('http://a.net/b/f', '/b', None, ())
+
+
+def test_dispatcher_cache():
+    app = Flask(__name__)
+
+    @app.route('/known')
+    def known():
+        return 'known'
+
+    class DummyFetcher(URLFetcher):
+        def fetch(self, url, headers=None):
+            return URLFetcherResponse(url, f'dummy {url}')
+
+    with app.test_request_context(base_url='http://a.net/b/'):
+        dispatcher = make_flask_url_dispatcher()
+        assert make_flask_url_dispatcher() is dispatcher
+        routes_dispatcher = make_flask_url_dispatcher(match_routes=True)
+        fetcher = make_url_fetcher(
+            dispatcher=routes_dispatcher, next_fetcher=DummyFetcher)
+    with app.test_request_context(base_url='http://a.net/c/'):
+        assert make_flask_url_dispatcher() is not dispatcher
+
+    # Dispatchers stored for forged hosts are bounded.
+    for i in range(MAX_DISPATCHERS + 5):
+        with app.test_request_context(base_url=f'http://{i}.forged/'):
+            make_flask_url_dispatcher()
+    assert len(app.extensions['weasyprint_dispatchers']) == MAX_DISPATCHERS
+
+    result = (app, 'http://a.net/b', '/known?d')
+    assert dispatcher('http://a.net/b/known?d') == result
+    assert dispatcher(b'http://a.net/b/known?d') == result
+    assert dispatcher('http://a.net/b/unknown') == (app, 'http://a.net/b', '/unknown')
+    assert dispatcher('http://a.net/other') is None
+    assert len(dispatcher) == 3
+
+    assert routes_dispatcher('http://a.net/b/known') == (*result[:2], '/known')
+    assert routes_dispatcher('http://a.net/b/unknown') is None
+    assert fetcher.fetch('http://a.net/b/known').read() == b'known'
+    assert fetcher.fetch('http://a.net/b/unknown').read() == (
+        b'dummy http://a.net/b/unknown')
+
+
 @pytest.mark.parametrize('url', [
     'http://example.net/Unïĉodé/pass !',
     'http://example.net/foo%20bar/p%61ss%C2%A0!',